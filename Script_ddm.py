@@ -8,19 +8,32 @@ print('Autenticado com sucesso!')
 # --- INSTALAÇÕES E IMPORTS ---
 
 import pandas as pd
+import numpy as np
 from google.cloud import bigquery
-import requests
 import os
 import re
+import shutil
+import functools
+import json
+import hashlib
+import time
+
+from etl_comum import (
+    iniciar_registro_execucao, hash_arquivo, registrar_fonte, finalizar_registro_execucao,
+    PASTA_CHECKPOINTS, baixar_arquivo, identificar_fontes, executar_com_checkpoints,
+    carregar_tabelas_bigquery, salvar_metadados_bigquery,
+)
 
 # =============================================
 # ETAPA 1: EXTRAÇÃO
 # =============================================
 
-def extrair_e_consolidar_dados(lista_de_links, pasta_downloads='downloads'):
+def extrair_e_consolidar_dados(lista_de_links, pasta_downloads='downloads', registro=None, ja_baixados=()):
     """
     Recebe uma lista de URLs de arquivos Excel, baixa todos,
     lê todas as abas e consolida em um único DataFrame.
+    Se receber um registro de execução, anota a linhagem de cada aba lida.
+    URLs em ja_baixados não são baixadas de novo.
     """
     print(f"Iniciando download de {len(lista_de_links)} arquivos.")
 
@@ -28,16 +41,16 @@ def extrair_e_consolidar_dados(lista_de_links, pasta_downloads='downloads'):
     if not os.path.exists(pasta_downloads):
         os.makedirs(pasta_downloads)
 
+    segundos_download = {}
     for url_arquivo in lista_de_links:
         nome_arquivo = url_arquivo.split('/')[-1]
-        caminho_arquivo = os.path.join(pasta_downloads, nome_arquivo)
-        print(f"Baixando '{nome_arquivo}'...")
+        if url_arquivo in ja_baixados:
+            print(f"'{nome_arquivo}' já foi baixado nesta execução.")
+            continue
 
-        with requests.get(url_arquivo, stream=True) as r:
-            r.raise_for_status()
-            with open(caminho_arquivo, 'wb') as f:
-                for chunk in r.iter_content(chunk_size=8192):
-                    f.write(chunk)
+        inicio_download = time.perf_counter()
+        baixar_arquivo(url_arquivo, pasta_downloads)
+        segundos_download[nome_arquivo] = round(time.perf_counter() - inicio_download, 3)
 
     print("\nTodos os arquivos foram baixados com sucesso.")
 
@@ -49,12 +62,24 @@ def extrair_e_consolidar_dados(lista_de_links, pasta_downloads='downloads'):
             print(f"Lendo todas as abas do arquivo: {arquivo}")
 
             # Lê todas as abas do arquivo Excel para um dicionário de DataFrames
+            inicio_leitura = time.perf_counter()
             dicionario_de_abas = pd.read_excel(caminho_completo, sheet_name=None)
+            segundos_leitura = round(time.perf_counter() - inicio_leitura, 3)
+            sha256 = hash_arquivo(caminho_completo)
+            tamanho = os.path.getsize(caminho_completo)
 
             # Itera sobre cada aba (DataFrame) lida do arquivo
             for nome_aba, df_aba in dicionario_de_abas.items():
                 print(f" -> Processando aba: '{nome_aba}'")
-                lista_dfs.append(df_aba)
+                # Filtra as regiões já na leitura, para não acumular o estado inteiro
+                df_filtrado = filtrar_regioes(df_aba)
+                lista_dfs.append(df_filtrado)
+                registrar_fonte(
+                    registro, arquivo=arquivo, aba=nome_aba, sha256=sha256, bytes=tamanho,
+                    linhas_lidas=len(df_aba), linhas_mantidas=len(df_filtrado),
+                    segundos_download=segundos_download.get(arquivo),
+                    segundos_leitura_arquivo=segundos_leitura,
+                )
 
     if not lista_dfs:
         print("Nenhuma planilha lida.")
@@ -62,27 +87,235 @@ def extrair_e_consolidar_dados(lista_de_links, pasta_downloads='downloads'):
 
     # Concatena todos os DataFrames da lista em um só
     df_consolidado = pd.concat(lista_dfs, ignore_index=True)
-    print(f"\nDados consolidados! Total de {len(df_consolidado)} registros.")
-    return df_consolidado
+    print(f"\nDados consolidados! Total de {len(df_consolidado)} registros das regiões configuradas.")
+    return otimizar_colunas_texto(df_consolidado)
+
+
+def filtrar_regioes(df):
+    """
+    Mantém apenas os registros das regiões configuradas em
+    municipios_desejados e delegacias_desejadas. Como roda em cada aba,
+    uma aba sem as colunas de região é descartada (na versão que filtrava
+    depois da concatenação essas linhas ficavam com NaN e eram removidas).
+    """
+    if 'NOME_DELEGACIA' not in df.columns or 'NOME_MUNICIPIO' not in df.columns:
+        print("Aviso: Colunas 'NOME_DELEGACIA' ou 'NOME_MUNICIPIO' não encontradas. Pulando a aba.")
+        return df.iloc[0:0].copy()
+    municipios = df['NOME_MUNICIPIO'].str.upper()
+    delegacias = df['NOME_DELEGACIA'].str.upper()
+
+    mascara = pd.Series(True, index=df.index)
+    if municipios_desejados is not None:
+        mascara &= municipios.isin(municipios_desejados)
+    if delegacias_desejadas is None:
+        mascara &= delegacias.str.startswith(PREFIXO_DELEGACIA, na=False)
+    else:
+        mascara &= delegacias.isin(delegacias_desejadas)
+
+    return df[mascara].copy()
+
+
+# =============================================
+# --- ARMAZENAMENTO DE TEXTO ---
+# =============================================
+# As colunas de texto ficam em strings do Arrow em vez de objetos Python
+# do início ao fim do pipeline (leitura, normalização e carga).
+
+TIPO_TEXTO = 'string[pyarrow]'
+
+
+def otimizar_colunas_texto(df, mostrar_relatorio=True):
+    """
+    Converte as colunas de texto (object) para strings armazenadas em Arrow
+    e imprime a memória de cada coluna antes e depois da conversão.
+    Colunas com valores misturados (ex: horários, números) ficam como estão.
+    """
+    memoria_antes = df.memory_usage(deep=True, index=False)
+
+    colunas_convertidas = []
+    for coluna in df.select_dtypes(include=['object']).columns:
+        # A hora continua como está, para ser carregada como TIME no BigQuery
+        if coluna.lower() == 'hora_ocorrencia_bo':
+            continue
+
+        if pd.api.types.infer_dtype(df[coluna], skipna=True) in ('string', 'empty'):
+            df[coluna] = df[coluna].astype(TIPO_TEXTO)
+            colunas_convertidas.append(coluna)
+
+    if mostrar_relatorio and colunas_convertidas:
+        memoria_depois = df.memory_usage(deep=True, index=False)
+        print("\n--- MEMÓRIA DAS COLUNAS DE TEXTO (MB): ANTES -> DEPOIS ---")
+        for coluna in colunas_convertidas:
+            print(f"{coluna:<30} {memoria_antes[coluna] / 1e6:>10.2f} -> {memoria_depois[coluna] / 1e6:>10.2f}")
+        total_antes = memoria_antes[colunas_convertidas].sum() / 1e6
+        total_depois = memoria_depois[colunas_convertidas].sum() / 1e6
+        print(f"{'TOTAL':<30} {total_antes:>10.2f} -> {total_depois:>10.2f}")
+
+    return df
+
+
+# =============================================
+# --- PARÂMETROS DA TRANSFORMAÇÃO ---
+# =============================================
+# Ficam fora das funções para serem compartilhados pelos dois motores
+# de transformação (Pandas e Polars).
+
+# Regiões processadas. None em municipios_desejados aceita todos os municípios;
+# None em delegacias_desejadas aceita todas as delegacias que começam com
+# PREFIXO_DELEGACIA (ou seja, todas as DDMs do estado).
+municipios_desejados = ['SOROCABA', 'VOTORANTIM']
+delegacias_desejadas = ['DDM SOROCABA', 'DDM VOTORANTIM']
+PREFIXO_DELEGACIA = 'DDM'
+
+# Normalização de bairros - ETAPA 1: ABREVIAÇÕES (troca pedaços)
+map_abreviacoes = {
+    r'\bjd\b': 'jardim',
+    r'\bjard\b': 'jardim',
+    r'\bvl\b': 'vila',
+    r'\bpq\b': 'parque',
+    r'\bprq\b': 'parque',
+    r'\bcent\b': 'centro',
+    r'\bcaguassu\b': 'caguacu'
+}
+
+# Normalização de bairros - ETAPA 2: CORREÇÕES TOTAIS (troca a string inteira)
+# Usamos ^ (início) e $ (fim) para garantir que trocamos
+# apenas se a string inteira for EXATAMENTE o que procuramos.
+# Este dicionário vale para Sorocaba e Votorantim (ver map_correcoes_por_municipio).
+map_correcoes_totais = {
+    r'^\s*b funda\s*$': 'barra funda',
+    r'^\s*bairro barra funda\s*$': 'barra funda',
+    r'^\s*morros\s*$': 'bairro dos morros',
+    r'^\s*bairro jacutinga\s*$': 'jacutinga',
+    r'^\s*bairro rio acima\s*$': 'rio acima',
+    r'^\s*cajuru\s*$': 'cajuru do sul',
+    r'^\s*campolim\s*$': 'parque campolim',
+    r'^\s*central parque sorocaba\s*$': 'central parque',
+    r'^\s*conjunto habitacional julio de mesquita\s*$': 'julio de mesquita filho',
+    r'^\s*julio de mesquita\s*$': 'julio de mesquita filho',
+    r'^\s*guaiba\s*$': 'jardim guaiba',
+    r'^\s*jardim archila\s*$': 'jardim archilla',
+    r'^\s*jardim magnolias\s*$': 'jardim magnolia',
+    r'^\s*jardim nikey\s*$': 'jardim nikkey',
+    r'^\s*jardim nikkei\s*$': 'jardim nikkey',
+    r'^\s*jatai\s*$': 'parque jatai',
+    r'^\s*nilton torres\s*$': 'jardim nilton torres',
+    r'^\s*wanel ville\s*$': 'jardim wanel ville',
+    r'^\s*zacarias\s*$': 'vila zacarias',
+    r'^\s*votocel\s*$': 'vila votocel',
+
+    # Regra para garantir que o bairro já certo permaneça
+    r'^\s*barra funda\s*$': 'barra funda',
+    r'^\s*nao informado\s*$': 'nao informado' # Garante o "Não Informado"
+}
+
+# Correções de bairros por município. Municípios que não estão aqui têm o
+# dicionário lido sob demanda de PASTA_CORRECOES_BAIRROS/<municipio>.json
+# (ex: correcoes_bairros/itu.json); sem arquivo, só a limpeza geral é aplicada.
+map_correcoes_por_municipio = {
+    'SOROCABA': map_correcoes_totais,
+    'VOTORANTIM': map_correcoes_totais,
+}
+PASTA_CORRECOES_BAIRROS = 'correcoes_bairros'
+
+mapa_dias = {
+    'Monday': 'Segunda-feira', 'Tuesday': 'Terça-feira', 'Wednesday': 'Quarta-feira',
+    'Thursday': 'Quinta-feira', 'Friday': 'Sexta-feira', 'Saturday': 'Sábado', 'Sunday': 'Domingo'
+}
+
+mapa_renomear = {
+    'NUM_BO': 'codigo_bo',
+    'NOME_MUNICIPIO': 'nome_municipio',
+    'NOME_DELEGACIA': 'nome_delegacia',
+    'ANO_ESTATISTICA': 'ano_ocorrencia',
+    'MES_OCORRENCIA': 'mes_ocorrencia',
+    'DATA_OCORRENCIA_BO': 'data_ocorrencia_bo',
+    'HORA_OCORRENCIA_BO': 'hora_ocorrencia_bo',
+    'DESC_PERIODO': 'periodo_ocorrencia',
+    'DIA_SEMANA': 'dia_semana',
+    'DESCR_SUBTIPOLOCAL': 'local_ocorrencia',
+    'BAIRRO': 'bairro',
+    'LOGRADOURO': 'logradouro',
+    'LATITUDE': 'latitude',
+    'LONGITUDE': 'longitude',
+    'RUBRICA': 'artigo_ocorrencia',
+    'NATUREZA_APURADA': 'tipo_ocorrencia'
+}
+
+ordem_final_colunas = [
+    'codigo_bo',
+    'nome_municipio',
+    'nome_delegacia',
+    'ano_ocorrencia',
+    'mes_ocorrencia',
+    'data_ocorrencia_bo',
+    'hora_ocorrencia_bo',
+    'periodo_ocorrencia',
+    'dia_semana',
+    'local_ocorrencia',
+    'bairro',
+    'logradouro',
+    'latitude',
+    'longitude',
+    'artigo_ocorrencia',
+    'tipo_ocorrencia',
+]
 
 
 # =============================================
 # ### FUNÇÃO DE NORMALIZAÇÃO
 # =============================================
 
-def normalizar_bairros(series_bairros):
+@functools.lru_cache(maxsize=None)
+def carregar_correcoes_municipio(municipio):
+    """
+    Devolve o dicionário de correções de bairros de um município. Os
+    arquivos da pasta PASTA_CORRECOES_BAIRROS só são lidos quando o
+    município aparece nos dados, e uma única vez por execução.
+    """
+    municipio = str(municipio).upper()
+    if municipio in map_correcoes_por_municipio:
+        return map_correcoes_por_municipio[municipio]
+
+    caminho = os.path.join(PASTA_CORRECOES_BAIRROS, f"{municipio.lower()}.json")
+    if not os.path.exists(caminho):
+        return {}
+
+    print(f"Carregando correções de bairros de '{municipio}': {caminho}")
+    with open(caminho, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def assinatura_correcoes_bairros():
+    """
+    Hash dos arquivos de correções por município, usado na chave do
+    checkpoint da normalização.
+    """
+    assinatura = {}
+    if os.path.exists(PASTA_CORRECOES_BAIRROS):
+        for arquivo in sorted(os.listdir(PASTA_CORRECOES_BAIRROS)):
+            if arquivo.endswith('.json'):
+                with open(os.path.join(PASTA_CORRECOES_BAIRROS, arquivo), 'rb') as f:
+                    assinatura[arquivo] = hashlib.sha256(f.read()).hexdigest()
+    return assinatura
+
+
+def normalizar_bairros(series_bairros, map_correcoes=None):
     """
     Recebe uma Series (coluna) do pandas e aplica uma normalização
     completa para nomes de bairros, em duas etapas.
+    Sem map_correcoes, usa o map_correcoes_totais.
     """
+    if map_correcoes is None:
+        map_correcoes = map_correcoes_totais
 
     # 1. Garante que é string e converte para minúsculo
-    col_norm = series_bairros.astype(str).str.lower()
+    col_norm = series_bairros.astype(TIPO_TEXTO).str.lower()
 
     # 2. Remove Acentos (ex: "vila antônia" -> "vila antonia")
+    # Decompõe os caracteres e descarta o que não é ASCII, sem sair do Arrow
     col_norm = col_norm.str.normalize('NFKD') \
-                       .str.encode('ascii', errors='ignore') \
-                       .str.decode('utf-8')
+                       .str.replace(r'[^\x00-\x7f]', '', regex=True)
 
     # 3. Remove pontuações (substitui por espaço)
     col_norm = col_norm.str.replace(r'[^a-z0-9\s]', ' ', regex=True)
@@ -91,50 +324,11 @@ def normalizar_bairros(series_bairros):
     col_norm = col_norm.str.replace(r'\s+', ' ', regex=True).str.strip()
 
     # 5. Mapeamento - ETAPA 1: ABREVIAÇÕES (troca pedaços)
-    map_abreviacoes = {
-        r'\bjd\b': 'jardim',
-        r'\bjard\b': 'jardim',
-        r'\bvl\b': 'vila',
-        r'\bpq\b': 'parque',
-        r'\bprq\b': 'parque',
-        r'\bcent\b': 'centro',
-        r'\bcaguassu\b': 'caguacu'
-    }
-
     # O Pandas permite aplicar o dicionário de replace de uma vez só
     col_norm = col_norm.replace(map_abreviacoes, regex=True)
 
     # 6. Mapeamento - ETAPA 2: CORREÇÕES TOTAIS (troca a string inteira)
-    # Usamos ^ (início) e $ (fim) para garantir que trocamos
-    # apenas se a string inteira for EXATAMENTE o que procuramos.
-    map_correcoes_totais = {
-        r'^\s*b funda\s*$': 'barra funda',
-        r'^\s*bairro barra funda\s*$': 'barra funda',
-        r'^\s*morros\s*$': 'bairro dos morros',
-        r'^\s*bairro jacutinga\s*$': 'jacutinga',
-        r'^\s*bairro rio acima\s*$': 'rio acima',
-        r'^\s*cajuru\s*$': 'cajuru do sul',
-        r'^\s*campolim\s*$': 'parque campolim',
-        r'^\s*central parque sorocaba\s*$': 'central parque',
-        r'^\s*conjunto habitacional julio de mesquita\s*$': 'julio de mesquita filho',
-        r'^\s*julio de mesquita\s*$': 'julio de mesquita filho',
-        r'^\s*guaiba\s*$': 'jardim guaiba',
-        r'^\s*jardim archila\s*$': 'jardim archilla',
-        r'^\s*jardim magnolias\s*$': 'jardim magnolia',
-        r'^\s*jardim nikey\s*$': 'jardim nikkey',
-        r'^\s*jardim nikkei\s*$': 'jardim nikkey',
-        r'^\s*jatai\s*$': 'parque jatai',
-        r'^\s*nilton torres\s*$': 'jardim nilton torres',
-        r'^\s*wanel ville\s*$': 'jardim wanel ville',
-        r'^\s*zacarias\s*$': 'vila zacarias',
-        r'^\s*votocel\s*$': 'vila votocel',
-        
-        # Regra para garantir que o bairro já certo permaneça
-        r'^\s*barra funda\s*$': 'barra funda',
-        r'^\s*nao informado\s*$': 'nao informado' # Garante o "Não Informado"
-    }
-    
-    col_norm = col_norm.replace(map_correcoes_totais, regex=True)
+    col_norm = col_norm.replace(map_correcoes, regex=True)
 
     # 7. Limpeza Final (remove espaços duplos e no início/fim de novo)
     # Isso garante que as trocas não criaram espaços extras
@@ -146,77 +340,79 @@ def normalizar_bairros(series_bairros):
     return col_norm
 
 
+def normalizar_bairros_por_municipio(series_bairros, series_municipios):
+    """
+    Normaliza os bairros usando o dicionário de correções de cada município.
+    O trabalho é feito sobre os pares únicos (município, bairro), então
+    processar N regiões custa praticamente o mesmo que processar uma.
+    """
+    pares = pd.DataFrame({
+        'municipio': series_municipios.astype(TIPO_TEXTO).str.upper().fillna(''),
+        'bairro': series_bairros.astype(TIPO_TEXTO),
+    })
+    pares_unicos = pares.drop_duplicates()
+    # Sem linhas (nenhuma região selecionada ou todas as datas inválidas): nada a normalizar
+    if pares_unicos.empty:
+        return series_bairros.copy()
+
+    partes = []
+    for municipio, grupo in pares_unicos.groupby('municipio', sort=False):
+        correcoes = carregar_correcoes_municipio(municipio)
+        partes.append(grupo.assign(bairro_normalizado=normalizar_bairros(grupo['bairro'], correcoes)))
+
+    mapa_bairros = pd.concat(partes, ignore_index=True)
+    resultado = pares.merge(mapa_bairros, on=['municipio', 'bairro'], how='left')['bairro_normalizado']
+    resultado.index = series_bairros.index
+    return resultado
+
+
 # =============================================
 # ETAPA 2: TRANSFORMAÇÃO
 # =============================================
 
-def transformar_dados(df):
+def normalizar_dados(df_consolidado):
     """
-    Função para filtrar, limpar e transformar o DataFrame.
+    Converte a data, preenche os campos vazios e normaliza os bairros.
     """
-    if df is None:
-        return None
-
-    # --- FILTRAGEM ---
-    delegacias_desejadas = ['DDM SOROCABA', 'DDM VOTORANTIM']
-    municipios_desejados = ['SOROCABA', 'VOTORANTIM']
-    df_filtrado = df[
-        (df['NOME_DELEGACIA'].str.upper().isin(delegacias_desejadas)) &
-        (df['NOME_MUNICIPIO'].str.upper().isin(municipios_desejados))
-    ].copy()
-    print(f"\nDados filtrados. {len(df_filtrado)} registros encontrados.")
-
-    # --- LIMPEZA E TRANSFORMAÇÃO ---
-    df_filtrado['DATA_OCORRENCIA_BO'] = pd.to_datetime(df_filtrado['DATA_OCORRENCIA_BO'], format='%d/%m/%Y', errors='coerce')
-    df_filtrado.dropna(subset=['DATA_OCORRENCIA_BO'], inplace=True)
+    df_normalizado = df_consolidado.copy()
+    df_normalizado['DATA_OCORRENCIA_BO'] = pd.to_datetime(df_normalizado['DATA_OCORRENCIA_BO'], format='%d/%m/%Y', errors='coerce')
+    df_normalizado.dropna(subset=['DATA_OCORRENCIA_BO'], inplace=True)
 
     colunas_para_preencher = ['DESC_PERIODO', 'BAIRRO', 'LOGRADOURO']
     for coluna in colunas_para_preencher:
-        df_filtrado[coluna] = df_filtrado[coluna].fillna('Não Informado')
+        df_normalizado[coluna] = df_normalizado[coluna].fillna('Não Informado')
 
     print("\nIniciando normalização de bairros...")
-    df_filtrado['BAIRRO'] = normalizar_bairros(df_filtrado['BAIRRO'])
+    df_normalizado['BAIRRO'] = normalizar_bairros_por_municipio(df_normalizado['BAIRRO'], df_normalizado['NOME_MUNICIPIO'])
     print("Normalização de bairros concluída.")
+    return df_normalizado
 
-    df_filtrado['MES_OCORRENCIA'] = df_filtrado['DATA_OCORRENCIA_BO'].dt.month
 
-    df_filtrado['DIA_SEMANA_EN'] = df_filtrado['DATA_OCORRENCIA_BO'].dt.day_name()
-    mapa_dias = {
-        'Monday': 'Segunda-feira', 'Tuesday': 'Terça-feira', 'Wednesday': 'Quarta-feira',
-        'Thursday': 'Quinta-feira', 'Friday': 'Sexta-feira', 'Saturday': 'Sábado', 'Sunday': 'Domingo'
-    }
-    df_filtrado['DIA_SEMANA'] = df_filtrado['DIA_SEMANA_EN'].map(mapa_dias)
-    df_filtrado.drop(columns=['DIA_SEMANA_EN'], inplace=True)
-
-    mapa_renomear = {
-        'NUM_BO': 'codigo_bo',
-        'NOME_MUNICIPIO': 'nome_municipio',
-        'NOME_DELEGACIA': 'nome_delegacia',
-        'ANO_ESTATISTICA': 'ano_ocorrencia',
-        'MES_OCORRENCIA': 'mes_ocorrencia',
-        'DATA_OCORRENCIA_BO': 'data_ocorrencia_bo',
-        'HORA_OCORRENCIA_BO': 'hora_ocorrencia_bo',
-        'DESC_PERIODO': 'periodo_ocorrencia',
-        'DIA_SEMANA': 'dia_semana',
-        'DESCR_SUBTIPOLOCAL': 'local_ocorrencia',
-        'BAIRRO': 'bairro',
-        'LOGRADOURO': 'logradouro',
-        'LATITUDE': 'latitude',
-        'LONGITUDE': 'longitude',
-        'RUBRICA': 'artigo_ocorrencia',
-        'NATUREZA_APURADA': 'tipo_ocorrencia'
-    }
-    df_renomeado = df_filtrado.rename(columns=mapa_renomear)
+def finalizar_dados(df_normalizado):
+    """
+    Cria as colunas derivadas, renomeia, formata os textos e garante
+    os tipos finais que serão carregados no BigQuery.
+    """
+    df_normalizado = df_normalizado.copy()
+    df_normalizado['MES_OCORRENCIA'] = df_normalizado['DATA_OCORRENCIA_BO'].dt.month
+
+    df_normalizado['DIA_SEMANA_EN'] = df_normalizado['DATA_OCORRENCIA_BO'].dt.day_name()
+    df_normalizado['DIA_SEMANA'] = df_normalizado['DIA_SEMANA_EN'].map(mapa_dias)
+    df_normalizado.drop(columns=['DIA_SEMANA_EN'], inplace=True)
+
+    df_renomeado = df_normalizado.rename(columns=mapa_renomear)
 
-    colunas_texto = df_renomeado.select_dtypes(include=['object']).columns
+    colunas_texto = df_renomeado.select_dtypes(include=['object', 'string']).columns
     for coluna in colunas_texto:
         # Pula a coluna de hora para não convertê-la em texto
         if coluna == 'hora_ocorrencia_bo':
             continue
 
-        df_renomeado[coluna] = df_renomeado[coluna].astype(str).str.title()
+        df_renomeado[coluna] = df_renomeado[coluna].astype(TIPO_TEXTO).str.title()
         df_renomeado[coluna] = df_renomeado[coluna].str.replace('Nao Informado', 'Não Informado')
         df_renomeado[coluna] = df_renomeado[coluna].str.replace('Nan', 'Não Informado')
+        # Valores ausentes também viram "Não Informado"
+        df_renomeado[coluna] = df_renomeado[coluna].fillna('Não Informado')
 
     # --- BLOCO FINAL DE GARANTIA DOS TIPOS ---
     print("\nGarantindo os tipos de dados corretos antes da carga...")
@@ -232,66 +428,553 @@ def transformar_dados(df):
     for coluna in ['latitude', 'longitude']:
         if coluna in df_renomeado.columns:
             # Substitui vírgula por ponto
-            df_renomeado[coluna] = df_renomeado[coluna].astype(str).str.replace(',', '.', regex=False)
+            df_renomeado[coluna] = df_renomeado[coluna].astype(TIPO_TEXTO).str.replace(',', '.', regex=False)
             # Converte para numérico
-            df_renomeado[coluna] = pd.to_numeric(df_renomeado[coluna], errors='coerce')
+            df_renomeado[coluna] = pd.to_numeric(df_renomeado[coluna], errors='coerce').astype('float64')
 
     # --- ORDENAR E SELECIONAR COLUNAS FINAIS ---
-    ordem_final_colunas = [
-        'codigo_bo',
-        'nome_municipio',
-        'nome_delegacia',
-        'ano_ocorrencia',
-        'mes_ocorrencia',
-        'data_ocorrencia_bo',
-        'hora_ocorrencia_bo',
-        'periodo_ocorrencia',
-        'dia_semana',
-        'local_ocorrencia',
-        'bairro',
-        'logradouro',
-        'latitude',
-        'longitude',
-        'artigo_ocorrencia',
-        'tipo_ocorrencia',
-    ]
     # Filtra para garantir que apenas colunas existentes sejam selecionadas
     colunas_existentes = [col for col in ordem_final_colunas if col in df_renomeado.columns]
-    df_transformado = df_renomeado[colunas_existentes]
+    return df_renomeado[colunas_existentes]
+
+
+def transformar_dados(df, motor='pandas'):
+    """
+    Função para limpar e transformar o DataFrame já filtrado por região
+    na extração. Com motor='polars' a mesma lógica roda como um plano
+    lazy do Polars (ver transformar_dados_polars).
+    """
+    if df is None:
+        return None
+
+    if motor == 'polars':
+        return transformar_dados_polars(df)
+
+    df_normalizado = normalizar_dados(df)
+    df_transformado = finalizar_dados(df_normalizado)
 
     print("Dados transformados com sucesso!")
     return df_transformado
 
 
+# =============================================
+# ETAPA 2 (ALTERNATIVA): TRANSFORMAÇÃO COM POLARS
+# =============================================
+
+def normalizar_bairros_polars(expr_bairros, map_correcoes=None):
+    """
+    Versão em expressão do Polars de normalizar_bairros. Aplica os mesmos
+    passos e os mesmos dicionários, na mesma ordem.
+    """
+    import polars as pl
+
+    if map_correcoes is None:
+        map_correcoes = map_correcoes_totais
+
+    # 1 e 2. Minúsculo e remoção de acentos
+    expr = expr_bairros.cast(pl.String).str.to_lowercase() \
+                       .str.normalize('NFKD') \
+                       .str.replace_all(r'[^\x00-\x7F]', '')
+
+    # 3 e 4. Remove pontuações e limpa espaços duplos
+    expr = expr.str.replace_all(r'[^a-z0-9\s]', ' ') \
+               .str.replace_all(r'\s+', ' ') \
+               .str.strip_chars()
+
+    # 5 e 6. Abreviações e correções totais (aplicadas em sequência, como no Pandas)
+    for padrao, substituto in list(map_abreviacoes.items()) + list(map_correcoes.items()):
+        expr = expr.str.replace_all(padrao, substituto)
+
+    # 7. Limpeza final
+    expr = expr.str.replace_all(r'\s+', ' ').str.strip_chars()
+    expr = expr.str.replace(r'^\s*$', 'nao informado')
+
+    return expr
+
+
+def normalizar_bairros_por_municipio_polars(df_pl, coluna_bairro, coluna_municipio):
+    """
+    Versão em Polars de normalizar_bairros_por_municipio: normaliza os
+    pares únicos (município, bairro) e junta o resultado de volta.
+    """
+    import polars as pl
+
+    df_pl = df_pl.with_columns(
+        pl.col(coluna_municipio).cast(pl.String).str.to_uppercase().fill_null('').alias('_municipio')
+    )
+    pares_unicos = df_pl.select('_municipio', coluna_bairro).unique(maintain_order=True)
+    if pares_unicos.height == 0:
+        return df_pl.drop('_municipio')
+
+    partes = []
+    for (municipio,), grupo in pares_unicos.group_by('_municipio', maintain_order=True):
+        correcoes = carregar_correcoes_municipio(municipio)
+        partes.append(grupo.with_columns(
+            normalizar_bairros_polars(pl.col(coluna_bairro), correcoes).alias('_bairro_normalizado')
+        ))
+
+    return df_pl.join(pl.concat(partes), on=['_municipio', coluna_bairro], how='left', maintain_order='left') \
+                .with_columns(pl.col('_bairro_normalizado').alias(coluna_bairro)) \
+                .drop('_municipio', '_bairro_normalizado')
+
+
+def preparar_bruto_para_polars(df_bruto):
+    """
+    Prepara o DataFrame bruto do Pandas para o pl.from_pandas: mantém só as
+    colunas usadas (mapa_renomear), converte a data como em normalizar_dados
+    e passa para texto as colunas de objeto com tipos misturados (ex: NUM_BO
+    com 'AB1234' e 12345), que o Arrow não consegue converter.
+    """
+    colunas = [col for col in mapa_renomear if col in df_bruto.columns]
+    df_bruto = df_bruto[colunas].copy()
+
+    if 'DATA_OCORRENCIA_BO' in df_bruto.columns:
+        df_bruto['DATA_OCORRENCIA_BO'] = pd.to_datetime(df_bruto['DATA_OCORRENCIA_BO'], format='%d/%m/%Y', errors='coerce')
+
+    for coluna in df_bruto.select_dtypes(include=['object']).columns:
+        if pd.api.types.infer_dtype(df_bruto[coluna], skipna=True) not in ('string', 'empty', 'time', 'date', 'datetime'):
+            df_bruto[coluna] = df_bruto[coluna].astype(TIPO_TEXTO)
+    return df_bruto
+
+
+def transformar_dados_polars(fonte):
+    """
+    Executa a mesma transformação de transformar_dados como um plano lazy
+    do Polars (multithread). Recebe um DataFrame do Pandas ou o caminho de
+    um arquivo bruto (.csv ou .parquet). Só no caso do arquivo o filtro de
+    delegacias/municípios e a seleção de colunas são empurrados para a
+    leitura; as planilhas .xlsx da SSP chegam aqui já lidas pelo Pandas
+    (etapa bruto), então não há esse ganho na leitura. Devolve um DataFrame
+    do Pandas com o mesmo formato.
+    """
+    import polars as pl
+
+    if fonte is None:
+        return None
+
+    if isinstance(fonte, str):
+        if fonte.endswith('.parquet'):
+            plano = pl.scan_parquet(fonte)
+        else:
+            plano = pl.scan_csv(fonte, infer_schema_length=10000)
+    else:
+        plano = pl.from_pandas(preparar_bruto_para_polars(fonte)).lazy()
+
+    schema_bruto = plano.collect_schema()
+
+    # --- SELEÇÃO DE COLUNAS (só lê o que vai para a tabela final) ---
+    colunas_derivadas = ['MES_OCORRENCIA', 'DIA_SEMANA']
+    colunas_brutas = [col for col in mapa_renomear if col in schema_bruto and col not in colunas_derivadas]
+    plano = plano.select(colunas_brutas)
+
+    # --- FILTRAGEM (mesmas regras de filtrar_regioes) ---
+    municipios = pl.col('NOME_MUNICIPIO').cast(pl.String).str.to_uppercase()
+    delegacias = pl.col('NOME_DELEGACIA').cast(pl.String).str.to_uppercase()
+    filtro = pl.lit(True)
+    if municipios_desejados is not None:
+        filtro &= municipios.is_in(municipios_desejados)
+    if delegacias_desejadas is None:
+        filtro &= delegacias.str.starts_with(PREFIXO_DELEGACIA).fill_null(False)
+    else:
+        filtro &= delegacias.is_in(delegacias_desejadas)
+    plano = plano.filter(filtro)
+
+    # --- LIMPEZA E TRANSFORMAÇÃO ---
+    if schema_bruto['DATA_OCORRENCIA_BO'] == pl.String:
+        data = pl.col('DATA_OCORRENCIA_BO').str.strptime(pl.Datetime('ns'), '%d/%m/%Y', strict=False)
+    else:
+        data = pl.col('DATA_OCORRENCIA_BO').cast(pl.Datetime('ns'))
+    plano = plano.with_columns(data).drop_nulls('DATA_OCORRENCIA_BO')
+
+    plano = plano.with_columns(
+        pl.col(coluna).cast(pl.String).fill_null('Não Informado')
+        for coluna in ['DESC_PERIODO', 'BAIRRO', 'LOGRADOURO']
+    )
+
+    # weekday() do Polars vai de 1 (segunda) a 7 (domingo), na mesma ordem de mapa_dias
+    dias_por_numero = dict(enumerate(mapa_dias.values(), start=1))
+    plano = plano.with_columns(
+        pl.col('DATA_OCORRENCIA_BO').dt.month().cast(pl.Int64).alias('MES_OCORRENCIA'),
+        pl.col('DATA_OCORRENCIA_BO').dt.weekday().replace_strict(dias_por_numero).alias('DIA_SEMANA'),
+    )
+
+    colunas_planejadas = plano.collect_schema().names()
+    plano = plano.rename({k: v for k, v in mapa_renomear.items() if k in colunas_planejadas})
+    plano = plano.select([col for col in ordem_final_colunas if col in plano.collect_schema().names()])
+
+    df_pl = plano.collect()
+    print(f"\nDados filtrados e transformados com Polars. {len(df_pl)} registros.")
+
+    # --- NORMALIZAR BAIRROS (por município, sobre os pares únicos) ---
+    df_pl = normalizar_bairros_por_municipio_polars(df_pl, 'bairro', 'nome_municipio')
+
+    # --- FORMATAR TEXTOS PARA "Title Case" ---
+    # Aplicado sobre os valores únicos de cada coluna e depois mapeado, para
+    # reproduzir exatamente o str.title() do Python usado no Pandas.
+    for coluna, tipo in df_pl.schema.items():
+        if tipo != pl.String or coluna == 'hora_ocorrencia_bo':
+            continue
+
+        valores = df_pl.get_column(coluna).fill_null('nan').unique().to_list()
+        mapa_titulo = {
+            valor: valor.title().replace('Nao Informado', 'Não Informado').replace('Nan', 'Não Informado')
+            for valor in valores
+        }
+        df_pl = df_pl.with_columns(pl.col(coluna).fill_null('nan').replace_strict(mapa_titulo))
+
+    # --- BLOCO FINAL DE GARANTIA DOS TIPOS ---
+    for coluna in ['ano_ocorrencia', 'mes_ocorrencia']:
+        if coluna in df_pl.columns:
+            numerico = pl.col(coluna)
+            if df_pl.schema[coluna] == pl.String:
+                numerico = numerico.cast(pl.Float64, strict=False)
+            df_pl = df_pl.with_columns(numerico.cast(pl.Int64, strict=False)).drop_nulls(coluna)
+
+    for coluna in ['latitude', 'longitude']:
+        if coluna in df_pl.columns:
+            df_pl = df_pl.with_columns(
+                pl.col(coluna).cast(pl.String)
+                              .str.replace(',', '.', literal=True)
+                              .cast(pl.Float64, strict=False)
+            )
+
+    print("Dados transformados com sucesso!")
+    df_final = otimizar_colunas_texto(df_pl.to_pandas(), mostrar_relatorio=False)
+
+    # O Polars devolve None nos vazios da coluna de hora; o Pandas usa NaN
+    if 'hora_ocorrencia_bo' in df_final.columns:
+        horas = df_final['hora_ocorrencia_bo'].astype(object)
+        df_final['hora_ocorrencia_bo'] = horas.where(horas.notna(), np.nan)
+    return df_final
+
+
+# =============================================
+# --- CHECKPOINTS DAS ETAPAS ---
+# =============================================
+
+def executar_pipeline_com_checkpoints(lista_de_links, motor='pandas', registro=None):
+    """
+    Monta as etapas do ETL (bruto, normalizado e final) e as executa com
+    checkpoints. O filtro de regiões é aplicado na extração, então faz
+    parte da etapa bruto. No motor Polars a transformação é um único
+    plano, então há apenas as etapas bruto e final.
+    """
+    fontes = identificar_fontes(lista_de_links)
+    # As fontes identificadas pelo conteúdo já foram baixadas
+    ja_baixados = {fonte['url'] for fonte in fontes if 'sha256' in fonte}
+    if registro is not None:
+        registro['entradas'] = fontes
+
+    config_regioes = {
+        'municipios': municipios_desejados,
+        'delegacias': delegacias_desejadas,
+        'prefixo_delegacia': PREFIXO_DELEGACIA,
+    }
+    config_bairros = {
+        'abreviacoes': map_abreviacoes,
+        'correcoes': map_correcoes_por_municipio,
+        'arquivos_correcoes': assinatura_correcoes_bairros(),
+    }
+    config_final = {'dias': mapa_dias, 'renomear': mapa_renomear, 'colunas': ordem_final_colunas}
+
+    etapas = [{
+        'nome': 'bruto',
+        'funcoes': [extrair_e_consolidar_dados, baixar_arquivo, filtrar_regioes, otimizar_colunas_texto],
+        'config': {'fontes': fontes, 'regioes': config_regioes},
+        'executar': lambda _: extrair_e_consolidar_dados(lista_de_links, registro=registro, ja_baixados=ja_baixados),
+    }]
+
+    if motor == 'polars':
+        etapas.append({
+            'nome': 'final_polars',
+            'funcoes': [transformar_dados_polars, preparar_bruto_para_polars, normalizar_bairros_por_municipio_polars,
+                        normalizar_bairros_polars, carregar_correcoes_municipio, otimizar_colunas_texto],
+            'config': {**config_bairros, **config_final},
+            'executar': transformar_dados_polars,
+        })
+    else:
+        etapas += [
+            {
+                'nome': 'normalizado',
+                'funcoes': [normalizar_dados, normalizar_bairros_por_municipio, normalizar_bairros,
+                            carregar_correcoes_municipio],
+                'config': config_bairros,
+                'executar': normalizar_dados,
+            },
+            {
+                'nome': 'final',
+                'funcoes': [finalizar_dados],
+                'config': config_final,
+                'executar': finalizar_dados,
+            },
+        ]
+
+    return executar_com_checkpoints(etapas, registro=registro)
+
+
+# =============================================
+# ETAPA 2.1: SÉRIES TEMPORAIS DAS OCORRÊNCIAS
+# =============================================
+# Tabela derivada com a contagem de ocorrências por dia, semana e mês para
+# cada combinação (município, delegacia, tipo), já com média móvel,
+# variação anual e índice sazonal, para o Looker não recalcular sobre as
+# linhas brutas. Tudo é calculado com NumPy numa grade densa séries x
+# períodos, mas a tabela só guarda as células em que a série tem
+# ocorrências ou média móvel diferente de zero.
+
+CHAVES_SERIE = ['nome_municipio', 'nome_delegacia', 'tipo_ocorrencia']
+GRANULARIDADES = ['dia', 'semana', 'mes']
+JANELAS_MEDIA_MOVEL = {'dia': 7, 'semana': 4, 'mes': 3}
+# 364 dias = 52 semanas, para comparar com o mesmo dia da semana do ano anterior
+DEFASAGEM_ANUAL = {'dia': 364, 'semana': 52, 'mes': 12}
+CAMINHO_SERIES = os.path.join(PASTA_CHECKPOINTS, 'series_ocorrencias.pkl')
+
+
+def indice_periodo(datas, granularidade):
+    """
+    Converte datas em inteiros de período: dias, semanas (começando na
+    segunda-feira) ou meses desde 01/01/1970.
+    """
+    dias = np.asarray(datas, dtype='datetime64[D]')
+    if granularidade == 'mes':
+        return dias.astype('datetime64[M]').astype(np.int64)
+
+    dias = dias.astype(np.int64)
+    if granularidade == 'semana':
+        # 01/01/1970 foi uma quinta-feira; o +3 faz as semanas começarem na segunda
+        return (dias + 3) // 7
+    return dias
+
+
+def inicio_periodo(indices, granularidade):
+    """Inverso de indice_periodo: devolve a data de início de cada período."""
+    if granularidade == 'mes':
+        return indices.astype('datetime64[M]').astype('datetime64[D]')
+    if granularidade == 'semana':
+        return (indices * 7 - 3).astype('datetime64[D]')
+    return indices.astype('datetime64[D]')
+
+
+def calcular_series(df, granularidade, periodo_inicial=None):
+    """
+    Conta as ocorrências de cada série numa grade densa (séries x períodos,
+    com zeros nos períodos sem registro) e calcula a média móvel e a
+    variação em relação ao ano anterior. Só viram linhas as células com
+    ocorrências ou média móvel maior que zero. Com periodo_inicial, só os
+    períodos a partir dele são gerados (atualização incremental).
+    """
+    grupos = df.groupby(CHAVES_SERIE, sort=True, observed=True)
+    codigos = grupos.ngroup().to_numpy()
+    chaves = grupos.size().index.to_frame(index=False)
+    periodos = indice_periodo(df['data_ocorrencia_bo'], granularidade)
+
+    # Primeiro período de cada série (as séries começam na primeira ocorrência)
+    primeiro = np.full(len(chaves), periodos.max())
+    np.minimum.at(primeiro, codigos, periodos)
+
+    janela = JANELAS_MEDIA_MOVEL[granularidade]
+    defasagem = DEFASAGEM_ANUAL[granularidade]
+
+    # Na atualização incremental, a grade só precisa cobrir o histórico
+    # usado pela média móvel e pela variação anual
+    p0 = periodos.min()
+    if periodo_inicial is not None:
+        p0 = max(p0, periodo_inicial - defasagem - janela)
+    n_periodos = periodos.max() - p0 + 1
+    n_series = len(chaves)
+
+    dentro = periodos >= p0
+    contagens = np.bincount(
+        codigos[dentro] * n_periodos + (periodos[dentro] - p0),
+        minlength=n_series * n_periodos,
+    ).reshape(n_series, n_periodos)
+
+    # Média móvel via soma acumulada
+    media_movel = np.full(contagens.shape, np.nan)
+    if n_periodos >= janela:
+        acumulado = np.cumsum(contagens, axis=1, dtype=np.float64)
+        anterior = np.concatenate([np.zeros((n_series, 1)), acumulado[:, :-janela]], axis=1)
+        media_movel[:, janela - 1:] = (acumulado[:, janela - 1:] - anterior) / janela
+
+    # Variação em relação ao mesmo período do ano anterior
+    ano_anterior = np.full(contagens.shape, np.nan)
+    if n_periodos > defasagem:
+        ano_anterior[:, defasagem:] = contagens[:, :-defasagem]
+    variacao = contagens - ano_anterior
+    with np.errstate(divide='ignore', invalid='ignore'):
+        variacao_pct = np.where(ano_anterior > 0, variacao / ano_anterior * 100, np.nan)
+
+    # Seleciona as células que viram linhas da tabela (a grade densa fica só aqui)
+    periodos_grade = p0 + np.arange(n_periodos)
+    mascara = periodos_grade[None, :] >= primeiro[:, None]
+    mascara &= (contagens > 0) | (media_movel > 0)
+    if periodo_inicial is not None:
+        mascara &= periodos_grade[None, :] >= periodo_inicial
+    serie_idx, periodo_idx = np.nonzero(mascara)
+
+    resultado = chaves.iloc[serie_idx].reset_index(drop=True)
+    resultado.insert(0, 'granularidade', granularidade)
+    resultado.insert(1, 'periodo', pd.to_datetime(inicio_periodo(periodos_grade[periodo_idx], granularidade)))
+    resultado['ocorrencias'] = contagens[serie_idx, periodo_idx]
+    resultado['media_movel'] = media_movel[serie_idx, periodo_idx]
+    resultado['variacao_anual'] = variacao[serie_idx, periodo_idx]
+    resultado['variacao_anual_pct'] = variacao_pct[serie_idx, periodo_idx]
+    return resultado
+
+
+def contar_estacoes(inicio, fim, deslocamento, n_estacoes):
+    """
+    Quantos períodos inteiros k em [inicio, fim] caem em cada estação
+    ((k + deslocamento) % n_estacoes), para cada série. Devolve uma matriz
+    séries x estações.
+    """
+    estacoes = np.arange(n_estacoes)
+    ate_fim = (fim[:, None] + deslocamento - estacoes[None, :]) // n_estacoes
+    antes_inicio = (inicio[:, None] - 1 + deslocamento - estacoes[None, :]) // n_estacoes
+    return ate_fim - antes_inicio
+
+
+def calcular_indices_sazonais(series):
+    """
+    Índice sazonal de cada série: média das ocorrências em cada mês do ano
+    (granularidade 'mes') ou dia da semana (granularidade 'dia') dividida
+    pela média geral da série. 1.0 = período típico. Como a tabela não
+    guarda os períodos zerados, as médias contam os períodos entre a
+    primeira ocorrência da série e o último período da tabela.
+    """
+    series['indice_sazonal'] = np.nan
+    # mês do ano = mês % 12; dia da semana (segunda = 0) = (dia + 3) % 7
+    for granularidade, n_estacoes, deslocamento in [('mes', 12, 0), ('dia', 7, 3)]:
+        linhas = series.index[series['granularidade'] == granularidade]
+        if len(linhas) == 0:
+            continue
+
+        sub = series.loc[linhas]
+        codigos = sub.groupby(CHAVES_SERIE, sort=False, observed=True).ngroup().to_numpy()
+        periodos = indice_periodo(sub['periodo'], granularidade)
+        estacao = (periodos + deslocamento) % n_estacoes
+        n_series = codigos.max() + 1
+
+        celulas = codigos * n_estacoes + estacao
+        ocorrencias = sub['ocorrencias'].to_numpy(dtype=np.float64)
+        soma = np.bincount(celulas, weights=ocorrencias, minlength=n_series * n_estacoes).reshape(-1, n_estacoes)
+
+        primeiro = np.full(n_series, periodos.max())
+        np.minimum.at(primeiro, codigos, periodos)
+        quantidade = contar_estacoes(primeiro, np.full(n_series, periodos.max()), deslocamento, n_estacoes)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            media_estacao = soma / quantidade
+            media_geral = soma.sum(axis=1) / quantidade.sum(axis=1)
+            indice = media_estacao / media_geral[:, None]
+
+        series.loc[linhas, 'indice_sazonal'] = indice[codigos, estacao]
+    return series
+
+
+def cortes_incrementais(ultimo_mes):
+    """
+    Para cada granularidade, devolve o período (e a data de início) a partir
+    do qual a atualização incremental recalcula, dado o último mês salvo.
+    """
+    cortes = {}
+    for granularidade in GRANULARIDADES:
+        corte = indice_periodo([ultimo_mes], granularidade)[0]
+        cortes[granularidade] = (corte, pd.Timestamp(inicio_periodo(np.array([corte]), granularidade)[0]))
+    return cortes
+
+
+def impressao_historico(df, data_corte):
+    """
+    Hash (independente da ordem das linhas) das ocorrências anteriores ao
+    corte, usando só o que entra nas séries: chaves e data. Se mudar, o
+    histórico salvo não vale mais (regiões ou correções diferentes,
+    revisões da SSP em meses antigos, etc.).
+    """
+    historico = df.loc[df['data_ocorrencia_bo'] < data_corte, CHAVES_SERIE + ['data_ocorrencia_bo']]
+    hashes = np.sort(pd.util.hash_pandas_object(historico, index=False).to_numpy())
+    return hashlib.sha256(hashes.tobytes()).hexdigest()
+
+
+def atualizar_series_temporais(df, caminho_series=CAMINHO_SERIES, recalcular_tudo=False):
+    """
+    Gera (ou atualiza) a tabela de séries temporais. Se já existe uma
+    versão salva e as ocorrências anteriores ao último mês salvo são as
+    mesmas de quando ela foi gerada, mantém esses períodos e só recalcula
+    a partir desse mês (que pode ter vindo incompleto). Caso contrário,
+    recalcula tudo. Os índices sazonais são refeitos sobre a tabela
+    inteira, pois são baratos.
+    """
+    if df is None or df.empty:
+        return None
+
+    anterior = None
+    if not recalcular_tudo and os.path.exists(caminho_series):
+        salvo = pd.read_pickle(caminho_series)
+        if isinstance(salvo, dict) and (salvo['series']['granularidade'] == 'mes').any():
+            cortes = cortes_incrementais(salvo['ultimo_mes'])
+            if all(impressao_historico(df, cortes[g][1]) == salvo['impressoes'][g] for g in GRANULARIDADES):
+                anterior = salvo['series']
+            else:
+                print("\nO histórico das ocorrências mudou desde a última execução.")
+
+    partes = []
+    if anterior is None:
+        print("\nCalculando séries temporais completas...")
+        for granularidade in GRANULARIDADES:
+            partes.append(calcular_series(df, granularidade))
+    else:
+        ultimo_mes = anterior.loc[anterior['granularidade'] == 'mes', 'periodo'].max()
+        print(f"\nAtualizando séries temporais a partir de {ultimo_mes:%m/%Y}...")
+        for granularidade, (corte, data_corte) in cortes_incrementais(ultimo_mes).items():
+            mantidas = anterior[(anterior['granularidade'] == granularidade) & (anterior['periodo'] < data_corte)]
+            partes += [mantidas, calcular_series(df, granularidade, periodo_inicial=corte)]
+
+    series = pd.concat(partes, ignore_index=True)
+    series = calcular_indices_sazonais(series)
+
+    # Guarda, junto com as séries, a impressão do histórico que a próxima
+    # execução vai manter (tudo antes do último mês)
+    ultimo_mes = series.loc[series['granularidade'] == 'mes', 'periodo'].max()
+    impressoes = {g: impressao_historico(df, data_corte) for g, (_, data_corte) in cortes_incrementais(ultimo_mes).items()}
+
+    os.makedirs(os.path.dirname(caminho_series), exist_ok=True)
+    pd.to_pickle({'series': series, 'ultimo_mes': ultimo_mes, 'impressoes': impressoes}, caminho_series)
+    print(f"Séries temporais prontas: {len(series)} linhas.")
+    return series
+
+
 # =============================================
 # ETAPA 3: CARGA PARA O GOOGLE BIGQUERY
 # =============================================
 
-def carregar_dados_bigquery(df, project_id, table_id, schema):
+PASTA_SAIDA = os.path.join('saida', 'dados_ddm')
+
+
+def salvar_saida_particionada(df, pasta_saida=PASTA_SAIDA):
     """
-    Função para carregar um DataFrame do Pandas em uma tabela do BigQuery
-    usando um schema pré-definido.
+    Grava o DataFrame final em CSVs particionados por município e
+    delegacia (saida/dados_ddm/municipio=<...>/delegacia=<...>/dados.csv), separando
+    as regiões em uma única passada sobre os dados.
     """
     if df is None or df.empty:
-        print("DataFrame está vazio. Nenhum dado para carregar.")
         return
 
-    full_table_id = f"{project_id}.{table_id}"
-    client = bigquery.Client(project=project_id)
-    print(f"\nConectado ao projeto '{project_id}'.")
+    # Grava numa pasta temporária e troca a saída inteira no final, para não
+    # sobrarem partições de regiões que saíram da configuração ou dos dados
+    pasta_temp = pasta_saida + '.tmp'
+    shutil.rmtree(pasta_temp, ignore_errors=True)
 
-    # Usamos o schema que definimos, em vez de autodetect
-    job_config = bigquery.LoadJobConfig(
-        schema=schema,
-        write_disposition="WRITE_TRUNCATE",
-    )
+    grupos = df.groupby(['nome_municipio', 'nome_delegacia'], sort=False, observed=True)
+    for (municipio, delegacia), df_regiao in grupos:
+        pasta = os.path.join(pasta_temp, f"municipio={municipio}", f"delegacia={delegacia}")
+        os.makedirs(pasta, exist_ok=True)
+        df_regiao.to_csv(os.path.join(pasta, 'dados.csv'), index=False)
 
-    print(f"Iniciando o carregamento de {len(df)} linhas para a tabela '{full_table_id}'...")
-    job = client.load_table_from_dataframe(df, full_table_id, job_config=job_config)
-    job.result()
-    print(f"Carga de dados concluída com sucesso!")
-    table = client.get_table(full_table_id)
-    print(f"A tabela agora contém {table.num_rows} linhas.")
+    shutil.rmtree(pasta_saida, ignore_errors=True)
+    os.replace(pasta_temp, pasta_saida)
+
+    print(f"\nSaída particionada em '{pasta_saida}': {grupos.ngroups} partições (município/delegacia).")
 
 
 # =============================================
@@ -317,6 +1000,22 @@ schema_definido = [
     bigquery.SchemaField("tipo_ocorrencia", "STRING", mode="NULLABLE"),
 ]
 
+schema_series = [
+    bigquery.SchemaField("granularidade", "STRING", mode="NULLABLE"),
+    bigquery.SchemaField("periodo", "DATE", mode="NULLABLE"),
+    bigquery.SchemaField("nome_municipio", "STRING", mode="NULLABLE"),
+    bigquery.SchemaField("nome_delegacia", "STRING", mode="NULLABLE"),
+    bigquery.SchemaField("tipo_ocorrencia", "STRING", mode="NULLABLE"),
+    bigquery.SchemaField("ocorrencias", "INTEGER", mode="NULLABLE"),
+    bigquery.SchemaField("media_movel", "FLOAT", mode="NULLABLE"),
+    bigquery.SchemaField("variacao_anual", "FLOAT", mode="NULLABLE"),
+    bigquery.SchemaField("variacao_anual_pct", "FLOAT", mode="NULLABLE"),
+    bigquery.SchemaField("indice_sazonal", "FLOAT", mode="NULLABLE"),
+]
+
+
+# Tabelas de metadados (compartilhadas pelos scripts, gravadas com WRITE_APPEND)
+
 
 # =============================================
 # --- FUNÇÃO DE DEBUG ---
@@ -359,12 +1058,23 @@ LINKS_DAS_PLANILHAS = [
     'https://www.ssp.sp.gov.br/assets/estatistica/transparencia/spDados/SPDadosCriminais_2025.xlsx'
 ]
 
-# 1. Extração
-dados_consolidados = extrair_e_consolidar_dados(LINKS_DAS_PLANILHAS)
+# Motor da transformação: 'pandas' (padrão) ou 'polars'
+MOTOR_TRANSFORMACAO = 'pandas'
+
+NOME_DO_PROJETO = "projetointegrador4-473718"
+ID_DA_TABELA = "dados_ssp.dados_ddm"
+
+# Um único cliente para todas as cargas (dados, séries e metadados)
+cliente_bq = bigquery.Client(project=NOME_DO_PROJETO)
+
+# Registro da execução: vai para logs/execucoes.jsonl e para as tabelas de metadados
+registro_execucao = iniciar_registro_execucao('Script_ddm.py')
+erro_execucao = None
 
-# 2. Transformação
-if dados_consolidados is not None:
-    dados_finais = transformar_dados(dados_consolidados)
+try:
+    # 1 e 2. Extração e Transformação (retoma do checkpoint válido mais profundo)
+    dados_finais = executar_pipeline_com_checkpoints(LINKS_DAS_PLANILHAS, motor=MOTOR_TRANSFORMACAO,
+                                                     registro=registro_execucao)
 
     # 3. ETAPA DE DEBUG ANTES DA CARGA
     if dados_finais is not None and not dados_finais.empty:
@@ -377,7 +1087,24 @@ if dados_consolidados is not None:
 
         print("\n--- FIM DO RAIO-X ---")
 
-        # 4. Carga para o BigQuery
-        NOME_DO_PROJETO = "projetointegrador4-473718"
-        ID_DA_TABELA = "dados_ssp.dados_ddm"
-        carregar_dados_bigquery(dados_finais, NOME_DO_PROJETO, ID_DA_TABELA, schema_definido)
+        # 4. Saída local particionada por região e carga para o BigQuery
+        salvar_saida_particionada(dados_finais)
+
+        # Séries temporais (tabela derivada, atualizada de forma incremental)
+        series_ocorrencias = atualizar_series_temporais(dados_finais)
+
+        # Todas as tabelas são carregadas juntas, com um único cliente
+        cargas = [
+            (dados_finais, ID_DA_TABELA, schema_definido),
+            (series_ocorrencias, "dados_ssp.series_ocorrencias", schema_series),
+        ]
+        registro_execucao['linhas_finais'] = len(dados_finais)
+        registro_execucao['cargas'] = carregar_tabelas_bigquery(cargas, NOME_DO_PROJETO, client=cliente_bq,
+                                                                id_execucao=registro_execucao['id_execucao'])
+except Exception as erro:
+    erro_execucao = erro
+    raise
+finally:
+    # 5. Registro da execução e linhagem das fontes (também em caso de falha)
+    finalizar_registro_execucao(registro_execucao, erro=erro_execucao)
+    salvar_metadados_bigquery(registro_execucao, NOME_DO_PROJETO, client=cliente_bq)
@@ -8,18 +8,33 @@ print('Autenticado com sucesso!')
 # --- INSTALAÇÕES E IMPORTS ---
 
 import pandas as pd
+import numpy as np
 from google.cloud import bigquery
-import requests
 import os
+import re
+import shutil
+import json
+import unicodedata
+import functools
+import hashlib
+import time
+
+from etl_comum import (
+    iniciar_registro_execucao, hash_arquivo, registrar_fonte, finalizar_registro_execucao,
+    baixar_arquivo, identificar_fontes, executar_com_checkpoints,
+    carregar_tabelas_bigquery, salvar_metadados_bigquery,
+)
 
 # =============================================
 # ETAPA 1: EXTRAÇÃO
 # =============================================
 
-def extrair_e_consolidar_dados(lista_de_links, pasta_downloads='downloads'):
+def extrair_e_consolidar_dados(lista_de_links, pasta_downloads='downloads', registro=None, ja_baixados=()):
     """
     Recebe uma lista de URLs de arquivos Excel, baixa todos,
     lê APENAS as abas desejadas e consolida em um único DataFrame.
+    Se receber um registro de execução, anota a linhagem de cada aba lida.
+    URLs em ja_baixados não são baixadas de novo.
     """
     print(f"Iniciando download de {len(lista_de_links)} arquivos.")
 
@@ -27,16 +42,16 @@ def extrair_e_consolidar_dados(lista_de_links, pasta_downloads='downloads'):
     if not os.path.exists(pasta_downloads):
         os.makedirs(pasta_downloads)
 
+    segundos_download = {}
     for url_arquivo in lista_de_links:
         nome_arquivo = url_arquivo.split('/')[-1]
-        caminho_arquivo = os.path.join(pasta_downloads, nome_arquivo)
-        print(f"Baixando '{nome_arquivo}'...")
+        if url_arquivo in ja_baixados:
+            print(f"'{nome_arquivo}' já foi baixado nesta execução.")
+            continue
 
-        with requests.get(url_arquivo, stream=True) as r:
-            r.raise_for_status()
-            with open(caminho_arquivo, 'wb') as f:
-                for chunk in r.iter_content(chunk_size=8192):
-                    f.write(chunk)
+        inicio_download = time.perf_counter()
+        baixar_arquivo(url_arquivo, pasta_downloads)
+        segundos_download[nome_arquivo] = round(time.perf_counter() - inicio_download, 3)
 
     print("\nTodos os arquivos foram baixados com sucesso.")
 
@@ -48,7 +63,11 @@ def extrair_e_consolidar_dados(lista_de_links, pasta_downloads='downloads'):
             print(f"Lendo arquivo: {arquivo}")
 
             # Lê todas as abas do arquivo Excel para um dicionário de DataFrames
+            inicio_leitura = time.perf_counter()
             dicionario_de_abas = pd.read_excel(caminho_completo, sheet_name=None)
+            segundos_leitura = round(time.perf_counter() - inicio_leitura, 3)
+            sha256 = hash_arquivo(caminho_completo)
+            tamanho = os.path.getsize(caminho_completo)
 
             # Itera sobre cada aba (DataFrame) lida do arquivo
             for nome_aba, df_aba in dicionario_de_abas.items():
@@ -56,7 +75,15 @@ def extrair_e_consolidar_dados(lista_de_links, pasta_downloads='downloads'):
                 # Verifica se o nome da aba (removendo espaços) começa com o prefixo desejado
                 if nome_aba.strip().startswith('PRESOS E APREENDIDOS'):
                     print(f" -> Processando aba: '{nome_aba}' (Corresponde ao filtro)")
-                    lista_dfs.append(df_aba)
+                    # Filtra as regiões já na leitura, para não acumular o estado inteiro
+                    df_filtrado = filtrar_regioes(df_aba)
+                    lista_dfs.append(df_filtrado)
+                    registrar_fonte(
+                        registro, arquivo=arquivo, aba=nome_aba, sha256=sha256, bytes=tamanho,
+                        linhas_lidas=len(df_aba), linhas_mantidas=len(df_filtrado),
+                        segundos_download=segundos_download.get(arquivo),
+                        segundos_leitura_arquivo=segundos_leitura,
+                    )
                 else:
                     # Aba ignorada pois não corresponde ao filtro
                     print(f" -> Ignorando aba: '{nome_aba}'")
@@ -67,27 +94,246 @@ def extrair_e_consolidar_dados(lista_de_links, pasta_downloads='downloads'):
 
     # Concatena todos os DataFrames da lista em um só
     df_consolidado = pd.concat(lista_dfs, ignore_index=True)
-    print(f"\nDados consolidados! Total de {len(df_consolidado)} registros.")
-    return df_consolidado
+    print(f"\nDados consolidados! Total de {len(df_consolidado)} registros das regiões configuradas.")
+    return otimizar_colunas_texto(df_consolidado)
+
+
+def filtrar_regioes(df):
+    """
+    Mantém apenas os registros das regiões configuradas em
+    municipios_desejados e delegacias_desejadas. Como roda em cada aba,
+    uma aba sem as colunas de região é descartada (na versão que filtrava
+    depois da concatenação essas linhas ficavam com NaN e eram removidas).
+    """
+    if 'NOME_DELEGACIA' not in df.columns or 'NOME_MUNICIPIO' not in df.columns:
+        print("Aviso: Colunas 'NOME_DELEGACIA' ou 'NOME_MUNICIPIO' não encontradas. Pulando a aba.")
+        return df.iloc[0:0].copy()
+
+    municipios = df['NOME_MUNICIPIO'].str.upper()
+    delegacias = df['NOME_DELEGACIA'].str.upper()
+
+    mascara = pd.Series(True, index=df.index)
+    if municipios_desejados is not None:
+        mascara &= municipios.isin(municipios_desejados)
+    if delegacias_desejadas is None:
+        mascara &= delegacias.str.startswith(PREFIXO_DELEGACIA, na=False)
+    else:
+        mascara &= delegacias.isin(delegacias_desejadas)
+
+    return df[mascara].copy()
+
+
+# =============================================
+# --- ARMAZENAMENTO DE TEXTO ---
+# =============================================
+# As colunas de texto ficam em strings do Arrow em vez de objetos Python
+# do início ao fim do pipeline (leitura, normalização e carga).
+
+TIPO_TEXTO = 'string[pyarrow]'
+
+
+def otimizar_colunas_texto(df, mostrar_relatorio=True):
+    """
+    Converte as colunas de texto (object) para strings armazenadas em Arrow
+    e imprime a memória de cada coluna antes e depois da conversão.
+    Colunas com valores misturados (ex: horários, números) ficam como estão.
+    """
+    memoria_antes = df.memory_usage(deep=True, index=False)
+
+    colunas_convertidas = []
+    for coluna in df.select_dtypes(include=['object']).columns:
+        # A hora continua como está, para ser carregada como TIME no BigQuery
+        if coluna.lower() == 'hora_ocorrencia_bo':
+            continue
+
+        if pd.api.types.infer_dtype(df[coluna], skipna=True) in ('string', 'empty'):
+            df[coluna] = df[coluna].astype(TIPO_TEXTO)
+            colunas_convertidas.append(coluna)
+
+    if mostrar_relatorio and colunas_convertidas:
+        memoria_depois = df.memory_usage(deep=True, index=False)
+        print("\n--- MEMÓRIA DAS COLUNAS DE TEXTO (MB): ANTES -> DEPOIS ---")
+        for coluna in colunas_convertidas:
+            print(f"{coluna:<30} {memoria_antes[coluna] / 1e6:>10.2f} -> {memoria_depois[coluna] / 1e6:>10.2f}")
+        total_antes = memoria_antes[colunas_convertidas].sum() / 1e6
+        total_depois = memoria_depois[colunas_convertidas].sum() / 1e6
+        print(f"{'TOTAL':<30} {total_antes:>10.2f} -> {total_depois:>10.2f}")
+
+    return df
+
+
+# =============================================
+# --- PARÂMETROS DA TRANSFORMAÇÃO ---
+# =============================================
+# Ficam fora das funções para entrarem na chave dos checkpoints das etapas.
+
+# Regiões processadas. None em municipios_desejados aceita todos os municípios;
+# None em delegacias_desejadas aceita todas as delegacias que começam com
+# PREFIXO_DELEGACIA (ou seja, todas as DDMs do estado).
+municipios_desejados = ['SOROCABA', 'VOTORANTIM']
+delegacias_desejadas = ['DDM SOROCABA', 'DDM VOTORANTIM']
+PREFIXO_DELEGACIA = 'DDM'
+
+# Normalização de bairros - ETAPA 1: ABREVIAÇÕES (troca pedaços)
+map_abreviacoes = {
+    r'\bjd\b': 'jardim',
+    r'\bjard\b': 'jardim',
+    r'\bvl\b': 'vila',
+    r'\bpq\b': 'parque',
+    r'\bprq\b': 'parque',
+    r'\bcent\b': 'centro',
+    r'\bcaguassu\b': 'caguacu'
+}
+
+# Normalização de bairros - ETAPA 2: CORREÇÕES TOTAIS (troca a string inteira)
+# Usamos ^ (início) e $ (fim) para garantir que trocamos
+# apenas se a string inteira for EXATAMENTE o que procuramos.
+# Este dicionário vale para Sorocaba e Votorantim (ver map_correcoes_por_municipio).
+map_correcoes_totais = {
+    r'^\s*b funda\s*$': 'barra funda',
+    r'^\s*bairro barra funda\s*$': 'barra funda',
+    r'^\s*morros\s*$': 'bairro dos morros',
+    r'^\s*bairro jacutinga\s*$': 'jacutinga',
+    r'^\s*bairro rio acima\s*$': 'rio acima',
+    r'^\s*cajuru\s*$': 'cajuru do sul',
+    r'^\s*campolim\s*$': 'parque campolim',
+    r'^\s*central parque sorocaba\s*$': 'central parque',
+    r'^\s*conjunto habitacional julio de mesquita\s*$': 'julio de mesquita filho',
+    r'^\s*julio de mesquita\s*$': 'julio de mesquita filho',
+    r'^\s*guaiba\s*$': 'jardim guaiba',
+    r'^\s*jardim archila\s*$': 'jardim archilla',
+    r'^\s*jardim magnolias\s*$': 'jardim magnolia',
+    r'^\s*jardim nikey\s*$': 'jardim nikkey',
+    r'^\s*jardim nikkei\s*$': 'jardim nikkey',
+    r'^\s*jatai\s*$': 'parque jatai',
+    r'^\s*nilton torres\s*$': 'jardim nilton torres',
+    r'^\s*wanel ville\s*$': 'jardim wanel ville',
+    r'^\s*zacarias\s*$': 'vila zacarias',
+    r'^\s*votocel\s*$': 'vila votocel',
+
+    # Regra para garantir que o bairro já certo permaneça
+    r'^\s*barra funda\s*$': 'barra funda',
+    r'^\s*nao informado\s*$': 'nao informado' # Garante o "Não Informado"
+}
+
+# Correções de bairros por município. Municípios que não estão aqui têm o
+# dicionário lido sob demanda de PASTA_CORRECOES_BAIRROS/<municipio>.json
+# (ex: correcoes_bairros/itu.json); sem arquivo, só a limpeza geral é aplicada.
+map_correcoes_por_municipio = {
+    'SOROCABA': map_correcoes_totais,
+    'VOTORANTIM': map_correcoes_totais,
+}
+PASTA_CORRECOES_BAIRROS = 'correcoes_bairros'
+
+mapa_dias = {
+    'Monday': 'Segunda-feira', 'Tuesday': 'Terça-feira', 'Wednesday': 'Quarta-feira',
+    'Thursday': 'Quinta-feira', 'Friday': 'Sexta-feira', 'Saturday': 'Sábado', 'Sunday': 'Domingo'
+}
+
+mapa_renomear = {
+    'NUM_BO': 'codigo_bo',
+    'NOME_MUNICIPIO': 'nome_municipio',
+    'NOME_DELEGACIA': 'nome_delegacia',
+    'MES_OCORRENCIA': 'mes_ocorrencia',
+    'DATA_OCORRENCIA_BO': 'data_ocorrencia_bo',
+    'HORA_OCORRENCIA_BO': 'hora_ocorrencia_bo',
+    'DESCR_PERIODO': 'periodo_ocorrencia',
+    'DIA_SEMANA': 'dia_semana',
+    'DESCR_SUBTIPOLOCAL': 'local_ocorrencia',
+    'BAIRRO': 'bairro',
+    'LOGRADOURO': 'logradouro',
+    'LATITUDE': 'latitude',
+    'LONGITUDE': 'longitude',
+    'NATUREZA_APURADA': 'tipo_ocorrencia',
+    'FLAG_FLAGRANTE': 'flagrante',
+    'DESCR_TIPO_PESSOA': 'natureza_autor',
+    'SEXO_PESSOA': 'sexo_autor',
+    'IDADE_PESSOA': 'idade_autor',
+    'COR_CURTIS': 'raca_autor',
+    'DESCR_PROFISSAO': 'profissao_autor',
+    'DESCR_GRAU_INSTRUCAO': 'escolaridade_autor'
+}
+
+ordem_final_colunas = [
+    'codigo_bo',
+    'nome_municipio',
+    'nome_delegacia',
+    'ano_ocorrencia',
+    'mes_ocorrencia',
+    'data_ocorrencia_bo',
+    'hora_ocorrencia_bo',
+    'periodo_ocorrencia',
+    'dia_semana',
+    'local_ocorrencia',
+    'bairro',
+    'logradouro',
+    'latitude',
+    'longitude',
+    'tipo_ocorrencia',
+    'flagrante',
+    'natureza_autor',
+    'sexo_autor',
+    'idade_autor',
+    'raca_autor',
+    'profissao_autor',
+    'escolaridade_autor'
+]
 
 
 # =============================================
 # ### FUNÇÃO DE NORMALIZAÇÃO
 # =============================================
 
-def normalizar_bairros(series_bairros):
+@functools.lru_cache(maxsize=None)
+def carregar_correcoes_municipio(municipio):
+    """
+    Devolve o dicionário de correções de bairros de um município. Os
+    arquivos da pasta PASTA_CORRECOES_BAIRROS só são lidos quando o
+    município aparece nos dados, e uma única vez por execução.
+    """
+    municipio = str(municipio).upper()
+    if municipio in map_correcoes_por_municipio:
+        return map_correcoes_por_municipio[municipio]
+
+    caminho = os.path.join(PASTA_CORRECOES_BAIRROS, f"{municipio.lower()}.json")
+    if not os.path.exists(caminho):
+        return {}
+
+    print(f"Carregando correções de bairros de '{municipio}': {caminho}")
+    with open(caminho, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def assinatura_correcoes_bairros():
+    """
+    Hash dos arquivos de correções por município, usado na chave do
+    checkpoint da normalização.
+    """
+    assinatura = {}
+    if os.path.exists(PASTA_CORRECOES_BAIRROS):
+        for arquivo in sorted(os.listdir(PASTA_CORRECOES_BAIRROS)):
+            if arquivo.endswith('.json'):
+                with open(os.path.join(PASTA_CORRECOES_BAIRROS, arquivo), 'rb') as f:
+                    assinatura[arquivo] = hashlib.sha256(f.read()).hexdigest()
+    return assinatura
+
+
+def normalizar_bairros(series_bairros, map_correcoes=None):
     """
     Recebe uma Series (coluna) do pandas e aplica uma normalização
     completa para nomes de bairros, em duas etapas.
+    Sem map_correcoes, usa o map_correcoes_totais.
     """
+    if map_correcoes is None:
+        map_correcoes = map_correcoes_totais
 
     # 1. Garante que é string e converte para minúsculo
-    col_norm = series_bairros.astype(str).str.lower()
+    col_norm = series_bairros.astype(TIPO_TEXTO).str.lower()
 
     # 2. Remove Acentos (ex: "vila antônia" -> "vila antonia")
+    # Decompõe os caracteres e descarta o que não é ASCII, sem sair do Arrow
     col_norm = col_norm.str.normalize('NFKD') \
-                       .str.encode('ascii', errors='ignore') \
-                       .str.decode('utf-8')
+                       .str.replace(r'[^\x00-\x7f]', '', regex=True)
 
     # 3. Remove pontuações (substitui por espaço)
     col_norm = col_norm.str.replace(r'[^a-z0-9\s]', ' ', regex=True)
@@ -96,50 +342,11 @@ def normalizar_bairros(series_bairros):
     col_norm = col_norm.str.replace(r'\s+', ' ', regex=True).str.strip()
 
     # 5. Mapeamento - ETAPA 1: ABREVIAÇÕES (troca pedaços)
-    map_abreviacoes = {
-        r'\bjd\b': 'jardim',
-        r'\bjard\b': 'jardim',
-        r'\bvl\b': 'vila',
-        r'\bpq\b': 'parque',
-        r'\bprq\b': 'parque',
-        r'\bcent\b': 'centro',
-        r'\bcaguassu\b': 'caguacu'
-    }
-
     # O Pandas permite aplicar o dicionário de replace de uma vez só
     col_norm = col_norm.replace(map_abreviacoes, regex=True)
 
     # 6. Mapeamento - ETAPA 2: CORREÇÕES TOTAIS (troca a string inteira)
-    # Usamos ^ (início) e $ (fim) para garantir que trocamos
-    # apenas se a string inteira for EXATAMENTE o que procuramos.
-    map_correcoes_totais = {
-        r'^\s*b funda\s*$': 'barra funda',
-        r'^\s*bairro barra funda\s*$': 'barra funda',
-        r'^\s*morros\s*$': 'bairro dos morros',
-        r'^\s*bairro jacutinga\s*$': 'jacutinga',
-        r'^\s*bairro rio acima\s*$': 'rio acima',
-        r'^\s*cajuru\s*$': 'cajuru do sul',
-        r'^\s*campolim\s*$': 'parque campolim',
-        r'^\s*central parque sorocaba\s*$': 'central parque',
-        r'^\s*conjunto habitacional julio de mesquita\s*$': 'julio de mesquita filho',
-        r'^\s*julio de mesquita\s*$': 'julio de mesquita filho',
-        r'^\s*guaiba\s*$': 'jardim guaiba',
-        r'^\s*jardim archila\s*$': 'jardim archilla',
-        r'^\s*jardim magnolias\s*$': 'jardim magnolia',
-        r'^\s*jardim nikey\s*$': 'jardim nikkey',
-        r'^\s*jardim nikkei\s*$': 'jardim nikkey',
-        r'^\s*jatai\s*$': 'parque jatai',
-        r'^\s*nilton torres\s*$': 'jardim nilton torres',
-        r'^\s*wanel ville\s*$': 'jardim wanel ville',
-        r'^\s*zacarias\s*$': 'vila zacarias',
-        r'^\s*votocel\s*$': 'vila votocel',
-
-        # Regra para garantir que o bairro já certo permaneça
-        r'^\s*barra funda\s*$': 'barra funda',
-        r'^\s*nao informado\s*$': 'nao informado' # Garante o "Não Informado"
-    }
-
-    col_norm = col_norm.replace(map_correcoes_totais, regex=True)
+    col_norm = col_norm.replace(map_correcoes, regex=True)
 
     # 7. Limpeza Final (remove espaços duplos e no início/fim de novo)
     # Isso garante que as trocas não criaram espaços extras
@@ -151,45 +358,45 @@ def normalizar_bairros(series_bairros):
     return col_norm
 
 
+def normalizar_bairros_por_municipio(series_bairros, series_municipios):
+    """
+    Normaliza os bairros usando o dicionário de correções de cada município.
+    O trabalho é feito sobre os pares únicos (município, bairro), então
+    processar N regiões custa praticamente o mesmo que processar uma.
+    """
+    pares = pd.DataFrame({
+        'municipio': series_municipios.astype(TIPO_TEXTO).str.upper().fillna(''),
+        'bairro': series_bairros.astype(TIPO_TEXTO),
+    })
+    pares_unicos = pares.drop_duplicates()
+    # Sem linhas (nenhuma região selecionada ou todas as datas inválidas): nada a normalizar
+    if pares_unicos.empty:
+        return series_bairros.copy()
+
+    partes = []
+    for municipio, grupo in pares_unicos.groupby('municipio', sort=False):
+        correcoes = carregar_correcoes_municipio(municipio)
+        partes.append(grupo.assign(bairro_normalizado=normalizar_bairros(grupo['bairro'], correcoes)))
+
+    mapa_bairros = pd.concat(partes, ignore_index=True)
+    resultado = pares.merge(mapa_bairros, on=['municipio', 'bairro'], how='left')['bairro_normalizado']
+    resultado.index = series_bairros.index
+    return resultado
+
+
 # =============================================
 # ETAPA 2: TRANSFORMAÇÃO
 # =============================================
 
-def transformar_dados(df):
+def normalizar_dados(df_consolidado):
     """
-    Função para filtrar, limpar e transformar o DataFrame.
+    Converte a data, preenche os campos vazios e normaliza os bairros.
     """
-    if df is None:
-        return None
+    df_normalizado = df_consolidado.copy()
 
-    # --- FILTRAGEM ---
-    if 'NOME_DELEGACIA' in df.columns and 'NOME_MUNICIPIO' in df.columns:
-        delegacias_desejadas = ['DDM SOROCABA', 'DDM VOTORANTIM']
-        municipios_desejados = ['SOROCABA', 'VOTORANTIM']
-        df_filtrado = df[
-            (df['NOME_DELEGACIA'].str.upper().isin(delegacias_desejadas)) &
-            (df['NOME_MUNICIPIO'].str.upper().isin(municipios_desejados))
-        ].copy()
-        print(f"\nDados filtrados. {len(df_filtrado)} registros encontrados.")
-    else:
-        print("Aviso: Colunas 'NOME_DELEGACIA' ou 'NOME_MUNICIPIO' não encontradas. Pulando filtragem.")
-        df_filtrado = df.copy()
-
-    # --- LIMPEZA E TRANSFORMAÇÃO ---
-    if 'DATA_OCORRENCIA_BO' in df_filtrado.columns:
-        df_filtrado['DATA_OCORRENCIA_BO'] = pd.to_datetime(df_filtrado['DATA_OCORRENCIA_BO'], format='%d/%m/%Y', errors='coerce')
-        df_filtrado.dropna(subset=['DATA_OCORRENCIA_BO'], inplace=True)
-
-        df_filtrado['MES_OCORRENCIA'] = df_filtrado['DATA_OCORRENCIA_BO'].dt.month
-        df_filtrado['ano_ocorrencia'] = df_filtrado['DATA_OCORRENCIA_BO'].dt.year
-
-        df_filtrado['DIA_SEMANA_EN'] = df_filtrado['DATA_OCORRENCIA_BO'].dt.day_name()
-        mapa_dias = {
-            'Monday': 'Segunda-feira', 'Tuesday': 'Terça-feira', 'Wednesday': 'Quarta-feira',
-            'Thursday': 'Quinta-feira', 'Friday': 'Sexta-feira', 'Saturday': 'Sábado', 'Sunday': 'Domingo'
-        }
-        df_filtrado['DIA_SEMANA'] = df_filtrado['DIA_SEMANA_EN'].map(mapa_dias)
-        df_filtrado.drop(columns=['DIA_SEMANA_EN'], inplace=True)
+    if 'DATA_OCORRENCIA_BO' in df_normalizado.columns:
+        df_normalizado['DATA_OCORRENCIA_BO'] = pd.to_datetime(df_normalizado['DATA_OCORRENCIA_BO'], format='%d/%m/%Y', errors='coerce')
+        df_normalizado.dropna(subset=['DATA_OCORRENCIA_BO'], inplace=True)
     else:
         print("Aviso: Coluna 'DATA_OCORRENCIA_BO' não encontrada. Cálculos de data serão pulados.")
 
@@ -197,60 +404,59 @@ def transformar_dados(df):
     for coluna in colunas_para_preencher:
 
         # Verifica se a coluna realmente existe no DataFrame antes de tentar modificá-la
-        if coluna in df_filtrado.columns:
-            df_filtrado[coluna] = df_filtrado[coluna].fillna('Não Informado')
+        if coluna in df_normalizado.columns:
+            df_normalizado[coluna] = df_normalizado[coluna].fillna('Não Informado')
         else:
             # Apenas avisa que a coluna do script não foi encontrada
             print(f"Aviso: Coluna '{coluna}' não encontrada. Ignorando.")
 
     # --- NORMALIZAR BAIRROS ---
-    if 'BAIRRO' in df_filtrado.columns:
+    if 'BAIRRO' in df_normalizado.columns:
         print("\nIniciando normalização de bairros...")
-        df_filtrado['BAIRRO'] = normalizar_bairros(df_filtrado['BAIRRO'])
+        if 'NOME_MUNICIPIO' in df_normalizado.columns:
+            df_normalizado['BAIRRO'] = normalizar_bairros_por_municipio(df_normalizado['BAIRRO'], df_normalizado['NOME_MUNICIPIO'])
+        else:
+            df_normalizado['BAIRRO'] = normalizar_bairros(df_normalizado['BAIRRO'])
         print("Normalização de bairros concluída.")
     else:
         print("\nAviso: Coluna 'BAIRRO' não encontrada, normalização de bairros pulada.")
 
-    # --- RENOMEAR COLUNAS ---
-    mapa_renomear = {
-        'NUM_BO': 'codigo_bo',
-        'NOME_MUNICIPIO': 'nome_municipio',
-        'NOME_DELEGACIA': 'nome_delegacia',
-        'MES_OCORRENCIA': 'mes_ocorrencia',
-        'DATA_OCORRENCIA_BO': 'data_ocorrencia_bo',
-        'HORA_OCORRENCIA_BO': 'hora_ocorrencia_bo',
-        'DESCR_PERIODO': 'periodo_ocorrencia',
-        'DIA_SEMANA': 'dia_semana',
-        'DESCR_SUBTIPOLOCAL': 'local_ocorrencia',
-        'BAIRRO': 'bairro',
-        'LOGRADOURO': 'logradouro',
-        'LATITUDE': 'latitude',
-        'LONGITUDE': 'longitude',
-        'NATUREZA_APURADA': 'tipo_ocorrencia',
-        'FLAG_FLAGRANTE': 'flagrante',
-        'DESCR_TIPO_PESSOA': 'natureza_autor',
-        'SEXO_PESSOA': 'sexo_autor',
-        'IDADE_PESSOA': 'idade_autor',
-        'COR_CURTIS': 'raca_autor',
-        'DESCR_PROFISSAO': 'profissao_autor',
-        'DESCR_GRAU_INSTRUCAO': 'escolaridade_autor'
-    }
+    return df_normalizado
+
+
+def finalizar_dados(df_normalizado):
+    """
+    Cria as colunas derivadas, renomeia, formata os textos e garante
+    os tipos finais que serão carregados no BigQuery.
+    """
+    df_normalizado = df_normalizado.copy()
+
+    if 'DATA_OCORRENCIA_BO' in df_normalizado.columns:
+        df_normalizado['MES_OCORRENCIA'] = df_normalizado['DATA_OCORRENCIA_BO'].dt.month
+        df_normalizado['ano_ocorrencia'] = df_normalizado['DATA_OCORRENCIA_BO'].dt.year
 
+        df_normalizado['DIA_SEMANA_EN'] = df_normalizado['DATA_OCORRENCIA_BO'].dt.day_name()
+        df_normalizado['DIA_SEMANA'] = df_normalizado['DIA_SEMANA_EN'].map(mapa_dias)
+        df_normalizado.drop(columns=['DIA_SEMANA_EN'], inplace=True)
+
+    # --- RENOMEAR COLUNAS ---
     # Filtra o mapa de renomeação para incluir apenas colunas que REALMENTE existem
-    mapa_renomear_valido = {k: v for k, v in mapa_renomear.items() if k in df_filtrado.columns}
+    mapa_renomear_valido = {k: v for k, v in mapa_renomear.items() if k in df_normalizado.columns}
     print(f"\nColunas renomeadas: {list(mapa_renomear_valido.keys())}")
-    df_renomeado = df_filtrado.rename(columns=mapa_renomear_valido)
+    df_renomeado = df_normalizado.rename(columns=mapa_renomear_valido)
 
     # --- FORMATAR TEXTOS PARA "Title Case" ---
-    colunas_texto = df_renomeado.select_dtypes(include=['object']).columns
+    colunas_texto = df_renomeado.select_dtypes(include=['object', 'string']).columns
     for coluna in colunas_texto:
         # Pula a coluna de hora para não convertê-la em texto
         if coluna == 'hora_ocorrencia_bo':
             continue
 
-        df_renomeado[coluna] = df_renomeado[coluna].astype(str).str.title()
+        df_renomeado[coluna] = df_renomeado[coluna].astype(TIPO_TEXTO).str.title()
         df_renomeado[coluna] = df_renomeado[coluna].str.replace('Nao Informado', 'Não Informado')
         df_renomeado[coluna] = df_renomeado[coluna].str.replace('Nan', 'Não Informado')
+        # Valores ausentes também viram "Não Informado"
+        df_renomeado[coluna] = df_renomeado[coluna].fillna('Não Informado')
 
     # --- BLOCO FINAL DE GARANTIA DOS TIPOS ---
     print("\nGarantindo os tipos de dados corretos antes da carga...")
@@ -268,9 +474,9 @@ def transformar_dados(df):
     for coluna in ['latitude', 'longitude']:
         if coluna in df_renomeado.columns:
             # Substitui vírgula por ponto
-            df_renomeado[coluna] = df_renomeado[coluna].astype(str).str.replace(',', '.', regex=False)
+            df_renomeado[coluna] = df_renomeado[coluna].astype(TIPO_TEXTO).str.replace(',', '.', regex=False)
             # Converte para numérico
-            df_renomeado[coluna] = pd.to_numeric(df_renomeado[coluna], errors='coerce')
+            df_renomeado[coluna] = pd.to_numeric(df_renomeado[coluna], errors='coerce').astype('float64')
 
     if 'hora_ocorrencia_bo' in df_renomeado.columns:
         print("Convertendo 'hora_ocorrencia_bo' para objetos 'time'...")
@@ -280,74 +486,260 @@ def transformar_dados(df):
         print("Conversão de hora concluída.")
 
     # --- ORDENAR E SELECIONAR COLUNAS FINAIS ---
-    ordem_final_colunas = [
-        'codigo_bo',
-        'nome_municipio',
-        'nome_delegacia',
-        'ano_ocorrencia',
-        'mes_ocorrencia',
-        'data_ocorrencia_bo',
-        'hora_ocorrencia_bo',
-        'periodo_ocorrencia',
-        'dia_semana',
-        'local_ocorrencia',
-        'bairro',
-        'logradouro',
-        'latitude',
-        'longitude',
-        'tipo_ocorrencia',
-        'flagrante',
-        'natureza_autor',
-        'sexo_autor',
-        'idade_autor',
-        'raca_autor',
-        'profissao_autor',
-        'escolaridade_autor'
-    ]
-
     # Filtra para garantir que apenas colunas existentes sejam selecionadas
     colunas_existentes = [col for col in ordem_final_colunas if col in df_renomeado.columns]
     print(f"\nColunas finais que serão carregadas: {colunas_existentes}")
-    df_transformado = df_renomeado[colunas_existentes]
+    return df_renomeado[colunas_existentes]
+
+
+def transformar_dados(df):
+    """
+    Função para limpar e transformar o DataFrame já filtrado por região
+    na extração.
+    """
+    if df is None:
+        return None
+
+    df_normalizado = normalizar_dados(df)
+    df_transformado = finalizar_dados(df_normalizado)
+    df_transformado = enriquecer_perfil_autor(df_transformado)
 
     print("Dados transformados com sucesso!")
     return df_transformado
 
 
+# =============================================
+# ETAPA 2.1: ENRIQUECIMENTO DO PERFIL DO AUTOR
+# =============================================
+# Idade, raça, escolaridade e profissão do autor ganham uma coluna com um
+# código inteiro pequeno e outra com o rótulo da categoria (faixa de idade,
+# raça/escolaridade padronizadas e grupo de profissão). As categorias vêm de
+# referencia_perfil_autor.json e viram tabelas de consulta montadas uma vez;
+# cada coluna é resolvida só nos seus valores únicos e depois expandida por
+# indexação de arrays. O código 0 é sempre "Não Informado".
+
+CAMINHO_REFERENCIA_PERFIL = 'referencia_perfil_autor.json'
+ROTULO_NAO_INFORMADO = 'Não Informado'
+
+# coluna de origem -> (dimensão da referência, coluna do código, coluna do rótulo)
+colunas_perfil_autor = {
+    'raca_autor': ('raca', 'codigo_raca_autor', 'categoria_raca_autor'),
+    'escolaridade_autor': ('escolaridade', 'codigo_escolaridade_autor', 'categoria_escolaridade_autor'),
+    'profissao_autor': ('profissao', 'codigo_grupo_profissao_autor', 'grupo_profissao_autor'),
+}
+
+
+def chave_referencia(texto):
+    """
+    Padroniza um texto para consulta na referência: sem acentos, em
+    maiúsculas, sem complementos entre parênteses como "(A)" e só com
+    letras, números e espaços simples.
+    """
+    texto = unicodedata.normalize('NFD', str(texto))
+    texto = ''.join(c for c in texto if not unicodedata.combining(c)).upper()
+    texto = re.sub(r'\(.*?\)', ' ', texto)
+    texto = re.sub(r'[^A-Z0-9]+', ' ', texto)
+    return texto.strip()
+
+
+@functools.lru_cache(maxsize=None)
+def carregar_referencia_perfil(caminho=CAMINHO_REFERENCIA_PERFIL):
+    """Lê o arquivo de referência das categorias do perfil do autor."""
+    with open(caminho, encoding='utf-8') as f:
+        return json.load(f)
+
+
+@functools.lru_cache(maxsize=None)
+def montar_tabelas_perfil(caminho=CAMINHO_REFERENCIA_PERFIL):
+    """
+    Monta as tabelas de consulta a partir da referência:
+    - idade: array em que a posição i guarda o código da faixa da idade i;
+    - demais dimensões: dicionário chave -> código, lista de prefixos
+      (prefixo, código) do mais longo para o mais curto, código padrão e
+      array de rótulos, com o rótulo do código 0 sendo "Não Informado".
+    """
+    referencia = carregar_referencia_perfil(caminho)
+
+    faixas = referencia['faixas_idade']
+    # np.digitize devolve 1 para a primeira faixa, então o 0 fica livre para "Não Informado"
+    tabela_idade = np.digitize(np.arange(faixas['idade_maxima'] + 1), faixas['limites']).astype('int8')
+    tabelas = {
+        'idade': (tabela_idade, np.array([ROTULO_NAO_INFORMADO] + faixas['rotulos'], dtype=object)),
+    }
+
+    for dimensao, _, _ in colunas_perfil_autor.values():
+        config = referencia[dimensao]
+        rotulos = [ROTULO_NAO_INFORMADO] + config['categorias']
+        codigo_por_rotulo = {rotulo: codigo for codigo, rotulo in enumerate(rotulos)}
+        codigo_por_chave = {chave: codigo_por_rotulo[rotulo] for chave, rotulo in config['valores'].items()}
+        codigo_por_prefixo = sorted(
+            ((prefixo, codigo_por_rotulo[rotulo]) for prefixo, rotulo in config.get('prefixos', {}).items()),
+            key=lambda item: len(item[0]), reverse=True,
+        )
+        tabelas[dimensao] = (codigo_por_chave, codigo_por_prefixo, codigo_por_rotulo[config['padrao']],
+                             np.array(rotulos, dtype=object))
+    return tabelas
+
+
+def codificar_idades(series_idades, tabela_idade):
+    """Converte idades em códigos de faixa indexando a tabela de faixas."""
+    idades = pd.to_numeric(series_idades, errors='coerce').to_numpy(dtype='float64', na_value=np.nan)
+    validas = (idades >= 0) & (idades < len(tabela_idade))
+
+    codigos = np.zeros(len(idades), dtype='int8')
+    codigos[validas] = tabela_idade[idades[validas].astype('int64')]
+    return codigos
+
+
+def codificar_categorias(series_valores, codigo_por_chave, codigo_por_prefixo, codigo_padrao):
+    """
+    Converte textos em códigos consultando a referência apenas nos valores
+    únicos. Um valor que não esteja em 'valores' é procurado nos 'prefixos'
+    da referência, palavra a palavra e do mais longo para o mais curto (ex:
+    "Vendedor(A) Ambulante" -> prefixo "VENDEDOR"). Sem correspondência,
+    recebe o código da categoria 'padrao'.
+    """
+    indices, unicos = pd.factorize(series_valores)
+
+    codigos_unicos = np.empty(len(unicos) + 1, dtype='int8')
+    for posicao, valor in enumerate(unicos):
+        chave = chave_referencia(valor)
+        codigo = codigo_por_chave.get(chave)
+        if codigo is None:
+            codigo = next((codigo_prefixo for prefixo, codigo_prefixo in codigo_por_prefixo
+                           if chave == prefixo or chave.startswith(prefixo + ' ')), codigo_padrao)
+        codigos_unicos[posicao] = codigo
+    # Valores ausentes têm índice -1, que aponta para a última posição ("Não Informado")
+    codigos_unicos[-1] = 0
+
+    return codigos_unicos[indices]
+
+
+def enriquecer_perfil_autor(df, caminho_referencia=CAMINHO_REFERENCIA_PERFIL):
+    """
+    Acrescenta as colunas codificadas (inteiros) e os rótulos das faixas de
+    idade, raça, escolaridade e grupos de profissão do autor.
+    """
+    if df is None:
+        return None
+
+    df = df.copy()
+    tabelas = montar_tabelas_perfil(caminho_referencia)
+
+    if 'idade_autor' in df.columns:
+        tabela_idade, rotulos = tabelas['idade']
+        codigos = codificar_idades(df['idade_autor'], tabela_idade)
+        df['codigo_faixa_idade_autor'] = codigos
+        df['faixa_idade_autor'] = pd.array(rotulos[codigos], dtype=TIPO_TEXTO)
+
+    for coluna, (dimensao, coluna_codigo, coluna_rotulo) in colunas_perfil_autor.items():
+        if coluna not in df.columns:
+            print(f"Aviso: Coluna '{coluna}' não encontrada para o enriquecimento do perfil.")
+            continue
+        codigo_por_chave, codigo_por_prefixo, codigo_padrao, rotulos = tabelas[dimensao]
+        codigos = codificar_categorias(df[coluna], codigo_por_chave, codigo_por_prefixo, codigo_padrao)
+        df[coluna_codigo] = codigos
+        df[coluna_rotulo] = pd.array(rotulos[codigos], dtype=TIPO_TEXTO)
+
+    print("Perfil do autor enriquecido com códigos e categorias.")
+    return df
+
+
+# =============================================
+# --- CHECKPOINTS DAS ETAPAS ---
+# =============================================
+
+def executar_pipeline_com_checkpoints(lista_de_links, registro=None):
+    """
+    Monta as etapas do ETL (bruto, normalizado, final e enriquecido) e as
+    executa com checkpoints. O filtro de regiões é aplicado na extração, então faz
+    parte da etapa bruto.
+    """
+    fontes = identificar_fontes(lista_de_links)
+    # As fontes identificadas pelo conteúdo já foram baixadas
+    ja_baixados = {fonte['url'] for fonte in fontes if 'sha256' in fonte}
+    if registro is not None:
+        registro['entradas'] = fontes
+
+    config_regioes = {
+        'municipios': municipios_desejados,
+        'delegacias': delegacias_desejadas,
+        'prefixo_delegacia': PREFIXO_DELEGACIA,
+    }
+    etapas = [
+        {
+            'nome': 'bruto',
+            'funcoes': [extrair_e_consolidar_dados, baixar_arquivo, filtrar_regioes, otimizar_colunas_texto],
+            'config': {'fontes': fontes, 'regioes': config_regioes},
+            'executar': lambda _: extrair_e_consolidar_dados(lista_de_links, registro=registro, ja_baixados=ja_baixados),
+        },
+        {
+            'nome': 'normalizado',
+            'funcoes': [normalizar_dados, normalizar_bairros_por_municipio, normalizar_bairros,
+                        carregar_correcoes_municipio],
+            'config': {
+                'abreviacoes': map_abreviacoes,
+                'correcoes': map_correcoes_por_municipio,
+                'arquivos_correcoes': assinatura_correcoes_bairros(),
+            },
+            'executar': normalizar_dados,
+        },
+        {
+            'nome': 'final',
+            'funcoes': [finalizar_dados],
+            'config': {'dias': mapa_dias, 'renomear': mapa_renomear, 'colunas': ordem_final_colunas},
+            'executar': finalizar_dados,
+        },
+        {
+            'nome': 'enriquecido',
+            'funcoes': [enriquecer_perfil_autor, codificar_categorias, codificar_idades,
+                        montar_tabelas_perfil, chave_referencia],
+            'config': {
+                'referencia': carregar_referencia_perfil(),
+                'colunas': colunas_perfil_autor,
+            },
+            'executar': enriquecer_perfil_autor,
+        },
+    ]
+
+    return executar_com_checkpoints(etapas, registro=registro)
+
+
 # =============================================
 # ETAPA 3: CARGA PARA O GOOGLE BIGQUERY
 # =============================================
 
-def carregar_dados_bigquery(df, project_id, table_id, schema):
+PASTA_SAIDA = os.path.join('saida', 'dados_produtividade')
+
+
+def salvar_saida_particionada(df, pasta_saida=PASTA_SAIDA):
     """
-    Função para carregar um DataFrame do Pandas em uma tabela do BigQuery
-    usando um schema pré-definido.
+    Grava o DataFrame final em CSVs particionados por município e
+    delegacia (saida/dados_produtividade/municipio=<...>/delegacia=<...>/dados.csv), separando
+    as regiões em uma única passada sobre os dados.
     """
     if df is None or df.empty:
-        print("DataFrame está vazio. Nenhum dado para carregar.")
         return
 
-    full_table_id = f"{project_id}.{table_id}"
-    client = bigquery.Client(project=project_id)
-    print(f"\nConectado ao projeto '{project_id}'.")
+    if 'nome_municipio' not in df.columns or 'nome_delegacia' not in df.columns:
+        print("Aviso: Colunas de região não encontradas. Saída particionada pulada.")
+        return
+
+    # Grava numa pasta temporária e troca a saída inteira no final, para não
+    # sobrarem partições de regiões que saíram da configuração ou dos dados
+    pasta_temp = pasta_saida + '.tmp'
+    shutil.rmtree(pasta_temp, ignore_errors=True)
 
-    # Filtra o schema para carregar apenas as colunas que existem no DF final
-    nomes_colunas_df = list(df.columns)
-    schema_filtrado = [campo for campo in schema if campo.name in nomes_colunas_df]
-    print(f"Schema filtrado para {len(schema_filtrado)} colunas existentes no DataFrame.")
+    grupos = df.groupby(['nome_municipio', 'nome_delegacia'], sort=False, observed=True)
+    for (municipio, delegacia), df_regiao in grupos:
+        pasta = os.path.join(pasta_temp, f"municipio={municipio}", f"delegacia={delegacia}")
+        os.makedirs(pasta, exist_ok=True)
+        df_regiao.to_csv(os.path.join(pasta, 'dados.csv'), index=False)
 
-    # Usamos o schema que definimos, em vez de autodetect
-    job_config = bigquery.LoadJobConfig(
-        schema=schema_filtrado, # Usa o schema filtrado
-        write_disposition="WRITE_TRUNCATE",
-    )
+    shutil.rmtree(pasta_saida, ignore_errors=True)
+    os.replace(pasta_temp, pasta_saida)
 
-    print(f"Iniciando o carregamento de {len(df)} linhas para a tabela '{full_table_id}'...")
-    job = client.load_table_from_dataframe(df, full_table_id, job_config=job_config)
-    job.result()
-    print(f"Carga de dados concluída com sucesso!")
-    table = client.get_table(full_table_id)
-    print(f"A tabela agora contém {table.num_rows} linhas.")
+    print(f"\nSaída particionada em '{pasta_saida}': {grupos.ngroups} partições (município/delegacia).")
 
 
 # =============================================
@@ -376,10 +768,21 @@ schema_definido = [
     bigquery.SchemaField("idade_autor", "INTEGER", mode="NULLABLE"),
     bigquery.SchemaField("raca_autor", "STRING", mode="NULLABLE"),
     bigquery.SchemaField("profissao_autor", "STRING", mode="NULLABLE"),
-    bigquery.SchemaField("escolaridade_autor", "STRING", mode="NULLABLE")
+    bigquery.SchemaField("escolaridade_autor", "STRING", mode="NULLABLE"),
+    bigquery.SchemaField("codigo_faixa_idade_autor", "INTEGER", mode="NULLABLE"),
+    bigquery.SchemaField("faixa_idade_autor", "STRING", mode="NULLABLE"),
+    bigquery.SchemaField("codigo_raca_autor", "INTEGER", mode="NULLABLE"),
+    bigquery.SchemaField("categoria_raca_autor", "STRING", mode="NULLABLE"),
+    bigquery.SchemaField("codigo_escolaridade_autor", "INTEGER", mode="NULLABLE"),
+    bigquery.SchemaField("categoria_escolaridade_autor", "STRING", mode="NULLABLE"),
+    bigquery.SchemaField("codigo_grupo_profissao_autor", "INTEGER", mode="NULLABLE"),
+    bigquery.SchemaField("grupo_profissao_autor", "STRING", mode="NULLABLE")
 ]
 
 
+# Tabelas de metadados (compartilhadas pelos scripts, gravadas com WRITE_APPEND)
+
+
 # =============================================
 # --- FUNÇÃO DE DEBUG ---
 # =============================================
@@ -419,12 +822,19 @@ LINKS_DAS_PLANILHAS = [
     'https://www.ssp.sp.gov.br/assets/estatistica/transparencia/spDados/DadosProdutividade_2025.xlsx'
 ]
 
-# 1. Extração
-dados_consolidados = extrair_e_consolidar_dados(LINKS_DAS_PLANILHAS)
+NOME_DO_PROJETO = "projetointegrador4-473718"
+ID_DA_TABELA = "dados_ssp.dados_produtividade"
+
+# Um único cliente para todas as cargas (dados e metadados)
+cliente_bq = bigquery.Client(project=NOME_DO_PROJETO)
+
+# Registro da execução: vai para logs/execucoes.jsonl e para as tabelas de metadados
+registro_execucao = iniciar_registro_execucao('Script_produtividade.py')
+erro_execucao = None
 
-# 2. Transformação
-if dados_consolidados is not None:
-    dados_finais = transformar_dados(dados_consolidados)
+try:
+    # 1 e 2. Extração e Transformação (retoma do checkpoint válido mais profundo)
+    dados_finais = executar_pipeline_com_checkpoints(LINKS_DAS_PLANILHAS, registro=registro_execucao)
 
     # 3. ETAPA DE DEBUG ANTES DA CARGA
     if dados_finais is not None and not dados_finais.empty:
@@ -437,7 +847,20 @@ if dados_consolidados is not None:
 
         print("\n--- FIM DO RAIO-X ---")
 
-        # 4. Carga para o BigQuery
-        NOME_DO_PROJETO = "projetointegrador4-473718"
-        ID_DA_TABELA = "dados_ssp.dados_produtividade"
-        carregar_dados_bigquery(dados_finais, NOME_DO_PROJETO, ID_DA_TABELA, schema_definido)
+        # 4. Saída local particionada por região e carga para o BigQuery
+        salvar_saida_particionada(dados_finais)
+
+        # Todas as tabelas são carregadas juntas, com um único cliente
+        cargas = [
+            (dados_finais, ID_DA_TABELA, schema_definido),
+        ]
+        registro_execucao['linhas_finais'] = len(dados_finais)
+        registro_execucao['cargas'] = carregar_tabelas_bigquery(cargas, NOME_DO_PROJETO, client=cliente_bq,
+                                                                id_execucao=registro_execucao['id_execucao'])
+except Exception as erro:
+    erro_execucao = erro
+    raise
+finally:
+    # 5. Registro da execução e linhagem das fontes (também em caso de falha)
+    finalizar_registro_execucao(registro_execucao, erro=erro_execucao)
+    salvar_metadados_bigquery(registro_execucao, NOME_DO_PROJETO, client=cliente_bq)
@@ -0,0 +1,557 @@
+"""
+Funções compartilhadas pelos scripts de ETL (Script_ddm.py e
+Script_produtividade.py): registro das execuções e linhagem das fontes,
+download das planilhas, checkpoints das etapas e carga no BigQuery. Este
+arquivo precisa estar na mesma pasta dos scripts (no Colab, envie-o junto
+com o notebook).
+"""
+import hashlib
+import inspect
+import json
+import os
+import re
+import time
+import uuid
+from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import pandas as pd
+import requests
+from google.cloud import bigquery
+from google.api_core import exceptions as erros_google
+
+
+# =============================================
+# --- REGISTRO DA EXECUÇÃO E LINHAGEM ---
+# =============================================
+# Cada execução gera um registro estruturado: quais arquivos/abas
+# alimentaram o pipeline (com hash), quantas linhas cada filtro removeu,
+# quanto tempo cada etapa levou e o resultado de cada carga. O registro vai
+# para um log local em JSONL e para as tabelas de metadados no BigQuery.
+
+PASTA_LOGS = 'logs'
+CAMINHO_LOG_EXECUCOES = os.path.join(PASTA_LOGS, 'execucoes.jsonl')
+ID_TABELA_EXECUCOES = 'dados_ssp.execucoes_pipeline'
+ID_TABELA_LINHAGEM = 'dados_ssp.linhagem_fontes'
+# Avisa quando uma fonte cresce mais que isso em relação à última execução
+LIMITE_CRESCIMENTO_FONTE = 1.5
+
+
+def iniciar_registro_execucao(script):
+    """
+    Cria o registro (dicionário) de uma execução do pipeline.
+    """
+    return {
+        'id_execucao': uuid.uuid4().hex,
+        'script': script,
+        'inicio': datetime.now(timezone.utc).isoformat(),
+        'fim': None,
+        'segundos': None,
+        'status': 'em_andamento',
+        'erro': None,
+        'linhas_finais': None,
+        'entradas': [],
+        'fontes': [],
+        'etapas': [],
+        'cargas': {},
+        '_relogio': time.perf_counter(),
+    }
+
+
+def hash_arquivo(caminho, tamanho_bloco=1024 * 1024):
+    """Calcula o SHA-256 de um arquivo, lendo em blocos."""
+    h = hashlib.sha256()
+    with open(caminho, 'rb') as f:
+        for bloco in iter(lambda: f.read(tamanho_bloco), b''):
+            h.update(bloco)
+    return h.hexdigest()
+
+
+def registrar_fonte(registro, **fonte):
+    """
+    Registra uma aba lida (arquivo, aba, sha256, bytes, linhas lidas e
+    mantidas pelo filtro de regiões, tempos de download e leitura).
+    """
+    if registro is not None:
+        registro['fontes'].append({**fonte, 'origem': 'execucao'})
+
+
+def salvar_fontes_checkpoint(registro, caminho_checkpoint):
+    """
+    Guarda a linhagem das fontes ao lado do checkpoint, para ser
+    restaurada quando uma execução retomar dele.
+    """
+    if registro is None:
+        return
+    caminho_temp = caminho_checkpoint + '.fontes.json.tmp'
+    with open(caminho_temp, 'w', encoding='utf-8') as f:
+        json.dump(registro['fontes'], f, ensure_ascii=False)
+    os.replace(caminho_temp, caminho_checkpoint + '.fontes.json')
+
+
+def restaurar_fontes_checkpoint(registro, caminho_checkpoint):
+    """
+    Recupera a linhagem das fontes que geraram o checkpoint. As linhas
+    ficam com origem 'checkpoint', já que os arquivos não foram lidos
+    nesta execução.
+    """
+    if registro is None:
+        return
+    caminho = caminho_checkpoint + '.fontes.json'
+    if not os.path.exists(caminho):
+        print(f"Aviso: o checkpoint '{caminho_checkpoint}' não tem a linhagem das fontes salva.")
+        return
+    with open(caminho, encoding='utf-8') as f:
+        registro['fontes'] = [dict(fonte, origem='checkpoint') for fonte in json.load(f)]
+
+
+def registrar_etapa(registro, etapa, segundos, linhas_entrada, linhas_saida, origem='execucao'):
+    """
+    Registra a duração de uma etapa e quantas linhas ela removeu.
+    origem é 'execucao' ou 'checkpoint' (quando a etapa foi retomada do disco).
+    """
+    if registro is None:
+        return
+    linhas_removidas = None
+    if linhas_entrada is not None and linhas_saida is not None:
+        linhas_removidas = linhas_entrada - linhas_saida
+    registro['etapas'].append({
+        'etapa': etapa,
+        'origem': origem,
+        'segundos': round(segundos, 3),
+        'linhas_entrada': linhas_entrada,
+        'linhas_saida': linhas_saida,
+        'linhas_removidas': linhas_removidas,
+    })
+
+
+def ler_historico_execucoes(caminho_log=CAMINHO_LOG_EXECUCOES):
+    """Lê todas as execuções já registradas no log local."""
+    if not os.path.exists(caminho_log):
+        return []
+    with open(caminho_log, encoding='utf-8') as f:
+        return [json.loads(linha) for linha in f if linha.strip()]
+
+
+def verificar_crescimento_fontes(registro, caminho_log=CAMINHO_LOG_EXECUCOES):
+    """
+    Compara as linhas de cada arquivo/aba com a última execução
+    bem-sucedida e avisa quando a fonte cresceu de forma anormal.
+    """
+    anteriores = {}
+    for execucao in ler_historico_execucoes(caminho_log):
+        if execucao['status'] == 'sucesso' and execucao['script'] == registro['script']:
+            for fonte in execucao['fontes']:
+                anteriores[(fonte['arquivo'], fonte['aba'])] = fonte
+
+    for fonte in registro['fontes']:
+        anterior = anteriores.get((fonte['arquivo'], fonte['aba']))
+        if anterior and anterior['linhas_lidas'] and fonte['linhas_lidas'] >= LIMITE_CRESCIMENTO_FONTE * anterior['linhas_lidas']:
+            print(f"!! Aviso: '{fonte['arquivo']}' / aba '{fonte['aba']}' passou de "
+                  f"{anterior['linhas_lidas']} para {fonte['linhas_lidas']} linhas.")
+
+
+def finalizar_registro_execucao(registro, erro=None, caminho_log=CAMINHO_LOG_EXECUCOES):
+    """
+    Fecha o registro (fim, duração, status) e acrescenta uma linha no log
+    local em JSONL. O status é 'falha' se a execução levantou erro,
+    'falha_carga' se alguma tabela não foi carregada, 'sem_dados' se não
+    houve dados finais e 'sucesso' nos demais casos.
+    """
+    if erro is not None:
+        status = 'falha'
+    elif any(carga['erro'] is not None for carga in registro['cargas'].values()):
+        status = 'falha_carga'
+    elif not registro['linhas_finais']:
+        status = 'sem_dados'
+    else:
+        status = 'sucesso'
+
+    registro['fim'] = datetime.now(timezone.utc).isoformat()
+    registro['segundos'] = round(time.perf_counter() - registro.pop('_relogio'), 3)
+    registro['status'] = status
+    registro['erro'] = None if erro is None else repr(erro)
+
+    verificar_crescimento_fontes(registro, caminho_log)
+
+    os.makedirs(os.path.dirname(caminho_log), exist_ok=True)
+    with open(caminho_log, 'a', encoding='utf-8') as f:
+        f.write(json.dumps(registro, ensure_ascii=False, default=str) + '\n')
+    print(f"\nExecução {registro['id_execucao']} registrada em '{caminho_log}' ({status}, {registro['segundos']}s).")
+    return registro
+
+
+def montar_tabelas_metadados(registro):
+    """
+    Converte o registro em dois DataFrames: uma linha da execução e uma
+    linha de linhagem por arquivo/aba de origem.
+    """
+    df_execucao = pd.DataFrame([{
+        'id_execucao': registro['id_execucao'],
+        'script': registro['script'],
+        'inicio': registro['inicio'],
+        'fim': registro['fim'],
+        'segundos': registro['segundos'],
+        'status': registro['status'],
+        'erro': registro['erro'],
+        'linhas_finais': registro['linhas_finais'],
+        'entradas': json.dumps(registro['entradas'], ensure_ascii=False),
+        'etapas': json.dumps(registro['etapas'], ensure_ascii=False),
+        'cargas': json.dumps(registro['cargas'], ensure_ascii=False, default=str),
+    }])
+    df_execucao['inicio'] = pd.to_datetime(df_execucao['inicio'])
+    df_execucao['fim'] = pd.to_datetime(df_execucao['fim'])
+    df_execucao['linhas_finais'] = df_execucao['linhas_finais'].astype(pd.Int64Dtype())
+
+    df_linhagem = pd.DataFrame(registro['fontes'], columns=[
+        'arquivo', 'aba', 'sha256', 'bytes', 'linhas_lidas', 'linhas_mantidas',
+        'segundos_download', 'segundos_leitura_arquivo', 'origem',
+    ])
+    df_linhagem.insert(0, 'id_execucao', registro['id_execucao'])
+    df_linhagem.insert(1, 'script', registro['script'])
+    df_linhagem['inicio_execucao'] = pd.to_datetime(registro['inicio'])
+    return df_execucao, df_linhagem
+
+
+# =============================================
+# --- DOWNLOAD DAS PLANILHAS ---
+# =============================================
+
+def baixar_arquivo(url_arquivo, pasta_downloads='downloads'):
+    """Baixa um arquivo para a pasta de downloads e devolve o caminho."""
+    if not os.path.exists(pasta_downloads):
+        os.makedirs(pasta_downloads)
+
+    nome_arquivo = url_arquivo.split('/')[-1]
+    caminho_arquivo = os.path.join(pasta_downloads, nome_arquivo)
+    print(f"Baixando '{nome_arquivo}'...")
+
+    with requests.get(url_arquivo, stream=True) as r:
+        r.raise_for_status()
+        with open(caminho_arquivo, 'wb') as f:
+            for chunk in r.iter_content(chunk_size=8192):
+                f.write(chunk)
+    return caminho_arquivo
+
+
+# =============================================
+# --- CHECKPOINTS DAS ETAPAS ---
+# =============================================
+# Cada etapa grava seu resultado em disco com uma chave que é o hash da
+# chave da etapa anterior + o código das funções que a produziram + a
+# configuração usada. Uma nova execução retoma do checkpoint válido mais
+# profundo: mudar só o map_correcoes_totais, por exemplo, reaproveita os
+# dados brutos (já filtrados por região) e refaz só a normalização em diante.
+
+PASTA_CHECKPOINTS = 'checkpoints'
+
+
+def identificar_fontes(lista_de_links, pasta_downloads='downloads'):
+    """
+    Identifica o conteúdo atual de cada URL sem baixar o arquivo, usando
+    os cabeçalhos ETag, Last-Modified e Content-Length (requisição HEAD).
+    Se a requisição falhar ou não trouxer ETag nem Last-Modified, o arquivo
+    é baixado e identificado pelo SHA-256 do conteúdo ('sha256'), para que
+    um checkpoint antigo nunca seja reaproveitado às cegas.
+    """
+    fontes = []
+    for url_arquivo in lista_de_links:
+        try:
+            resposta = requests.head(url_arquivo, allow_redirects=True, timeout=30)
+            resposta.raise_for_status()
+            cabecalhos = resposta.headers
+        except requests.RequestException:
+            cabecalhos = {}
+        fonte = {
+            'url': url_arquivo,
+            'etag': cabecalhos.get('ETag'),
+            'last_modified': cabecalhos.get('Last-Modified'),
+            'tamanho': cabecalhos.get('Content-Length'),
+        }
+        if fonte['etag'] is None and fonte['last_modified'] is None:
+            print(f"Sem ETag/Last-Modified para '{url_arquivo}'. Identificando pelo conteúdo.")
+            fonte['sha256'] = hash_arquivo(baixar_arquivo(url_arquivo, pasta_downloads))
+        fontes.append(fonte)
+    return fontes
+
+
+def _codigo_fonte(funcao):
+    """Devolve o código-fonte da função (ou o bytecode, se não houver fonte)."""
+    try:
+        return inspect.getsource(funcao)
+    except (OSError, TypeError):
+        return funcao.__code__.co_code.hex()
+
+
+def calcular_chave_etapa(chave_anterior, funcoes, config):
+    """
+    Gera a chave de uma etapa a partir da chave anterior, do código das
+    funções envolvidas e da configuração (dicionários, filtros, etc.).
+    """
+    h = hashlib.sha256()
+    h.update(chave_anterior.encode('utf-8'))
+    for funcao in funcoes:
+        h.update(_codigo_fonte(funcao).encode('utf-8'))
+    h.update(json.dumps(config, sort_keys=True, ensure_ascii=False, default=str).encode('utf-8'))
+    return h.hexdigest()[:16]
+
+
+def remover_checkpoints_antigos(pasta_checkpoints, ordem, nome_etapa, caminho_atual):
+    """
+    Apaga os checkpoints da mesma etapa gravados com chaves antigas (e a
+    linhagem salva junto), para a pasta não crescer a cada mudança de
+    configuração.
+    """
+    padrao = re.compile(rf"{ordem:02d}_{re.escape(nome_etapa)}_[0-9a-f]{{16}}\.pkl(\.fontes\.json)?")
+    for arquivo in os.listdir(pasta_checkpoints):
+        caminho = os.path.join(pasta_checkpoints, arquivo)
+        if padrao.fullmatch(arquivo) and caminho not in (caminho_atual, caminho_atual + '.fontes.json'):
+            os.remove(caminho)
+            print(f"Checkpoint antigo removido: {caminho}")
+
+
+def executar_com_checkpoints(etapas, pasta_checkpoints=PASTA_CHECKPOINTS, registro=None):
+    """
+    Executa uma lista de etapas encadeadas. Cada etapa é um dicionário com
+    'nome', 'funcoes', 'config' e 'executar' (recebe o DataFrame da etapa
+    anterior e devolve o seu). Retoma do checkpoint válido mais profundo.
+    Se receber um registro de execução, anota duração e linhas de cada etapa.
+    """
+    if not os.path.exists(pasta_checkpoints):
+        os.makedirs(pasta_checkpoints)
+
+    # 1. Calcula todas as chaves antes de executar qualquer etapa
+    caminhos = []
+    chave = ''
+    for ordem, etapa in enumerate(etapas):
+        chave = calcular_chave_etapa(chave, etapa['funcoes'], etapa['config'])
+        nome_arquivo = f"{ordem:02d}_{etapa['nome']}_{chave}.pkl"
+        caminhos.append(os.path.join(pasta_checkpoints, nome_arquivo))
+
+    # 2. Procura o checkpoint válido mais profundo
+    inicio = 0
+    df = None
+    for ordem in range(len(etapas) - 1, -1, -1):
+        if os.path.exists(caminhos[ordem]):
+            print(f"\nRetomando do checkpoint '{etapas[ordem]['nome']}': {caminhos[ordem]}")
+            inicio_etapa = time.perf_counter()
+            df = pd.read_pickle(caminhos[ordem])
+            restaurar_fontes_checkpoint(registro, caminhos[ordem])
+            registrar_etapa(registro, etapas[ordem]['nome'], time.perf_counter() - inicio_etapa,
+                            None, len(df), origem='checkpoint')
+            inicio = ordem + 1
+            break
+
+    # 3. Executa as etapas restantes, gravando o checkpoint de cada uma
+    for ordem in range(inicio, len(etapas)):
+        print(f"\n>>> Executando etapa '{etapas[ordem]['nome']}'")
+        inicio_etapa = time.perf_counter()
+        linhas_entrada = None if df is None else len(df)
+        df = etapas[ordem]['executar'](df)
+        registrar_etapa(registro, etapas[ordem]['nome'], time.perf_counter() - inicio_etapa,
+                        linhas_entrada, None if df is None else len(df))
+        if df is None:
+            print(f"Etapa '{etapas[ordem]['nome']}' não gerou dados. Interrompendo.")
+            return None
+
+        # Grava em arquivo temporário e renomeia, para não deixar checkpoint pela metade
+        caminho_temp = caminhos[ordem] + '.tmp'
+        df.to_pickle(caminho_temp)
+        os.replace(caminho_temp, caminhos[ordem])
+        salvar_fontes_checkpoint(registro, caminhos[ordem])
+        remover_checkpoints_antigos(pasta_checkpoints, ordem, etapas[ordem]['nome'], caminhos[ordem])
+
+    return df
+
+
+# =============================================
+# --- CARGA PARA O GOOGLE BIGQUERY ---
+# =============================================
+
+# Erros que podem passar numa nova tentativa (limite de taxa, instabilidade
+# do serviço, conexão). Erros de schema, 400, permissão etc. não são repetidos.
+ERROS_TRANSITORIOS = (
+    erros_google.TooManyRequests,
+    erros_google.InternalServerError,
+    erros_google.BadGateway,
+    erros_google.ServiceUnavailable,
+    erros_google.GatewayTimeout,
+    requests.ConnectionError,
+    requests.Timeout,
+)
+# Motivos (error_result['reason']) de jobs do BigQuery que valem nova tentativa
+MOTIVOS_TRANSITORIOS = {'backendError', 'internalError', 'rateLimitExceeded', 'jobBackendError', 'jobInternalError'}
+
+
+def erro_transitorio(erro, job=None):
+    """Diz se vale a pena tentar de novo a carga que falhou com esse erro."""
+    if isinstance(erro, ERROS_TRANSITORIOS):
+        return True
+    resultado = getattr(job, 'error_result', None)
+    return bool(resultado) and resultado.get('reason') in MOTIVOS_TRANSITORIOS
+
+
+def buscar_job_concluido(client, job_id):
+    """
+    Consulta o job no servidor e devolve-o se ele terminou sem erro (ou
+    None). Se ainda estiver rodando, espera terminar. Evita enviar de novo
+    uma carga que rodou, mas cuja resposta se perdeu.
+    """
+    try:
+        job = client.get_job(job_id)
+        if job.state != 'DONE':
+            job.result()
+    except Exception:
+        return None
+    if job.state == 'DONE' and job.error_result is None:
+        return job
+    return None
+
+
+def carregar_tabelas_bigquery(cargas, project_id, client=None, max_concorrencia=4, tentativas=3,
+                              espera_entre_tentativas=2, id_execucao=None):
+    """
+    Carrega várias tabelas no BigQuery ao mesmo tempo, reaproveitando um
+    único cliente. cargas é uma lista de (DataFrame, table_id, schema).
+    No máximo max_concorrencia cargas rodam juntas e cada uma é repetida
+    até tentativas vezes em caso de erro, com espera crescente entre elas
+    (espera_entre_tentativas, depois o dobro, ...); só erros transitórios
+    são repetidos. Com id_execucao, os jobs recebem ids derivados dele e,
+    antes de uma nova tentativa, o job anterior é consultado: se ele já
+    terminou no servidor, a carga não é reenviada (evita linhas duplicadas
+    em WRITE_APPEND). Devolve, por tabela, as linhas
+    carregadas, a latência, o número de tentativas e o erro (se houver).
+    Uma carga pode ter um quarto item com o write_disposition (o padrão é
+    "WRITE_TRUNCATE"; as tabelas de metadados usam "WRITE_APPEND").
+    """
+    cargas_validas = []
+    for carga in cargas:
+        df, table_id, schema = carga[:3]
+        modo_escrita = carga[3] if len(carga) > 3 else "WRITE_TRUNCATE"
+        if df is None or df.empty:
+            print(f"DataFrame de '{table_id}' está vazio. Nenhum dado para carregar.")
+        else:
+            cargas_validas.append((df, table_id, schema, modo_escrita))
+
+    if not cargas_validas:
+        return {}
+
+    if client is None:
+        client = bigquery.Client(project=project_id)
+        print(f"\nConectado ao projeto '{project_id}'.")
+
+    def carregar_uma(df, table_id, schema, modo_escrita):
+        full_table_id = f"{project_id}.{table_id}"
+
+        # Usamos o schema que definimos (só com as colunas que existem no DF), em vez de autodetect
+        schema_filtrado = [campo for campo in schema if campo.name in df.columns]
+        job_config = bigquery.LoadJobConfig(
+            schema=schema_filtrado,
+            write_disposition=modo_escrita,
+        )
+
+        inicio = time.perf_counter()
+        ultimo_erro = None
+        for tentativa in range(1, tentativas + 1):
+            job = None
+            job_id = None
+            if id_execucao is not None:
+                job_id = f"carga_{table_id.replace('.', '_')}_{id_execucao}_{tentativa}"
+            try:
+                print(f"Iniciando o carregamento de {len(df)} linhas para a tabela '{full_table_id}' (tentativa {tentativa})...")
+                job = client.load_table_from_dataframe(df, full_table_id, job_config=job_config, job_id=job_id)
+                job.result()
+            except Exception as erro:
+                ultimo_erro = erro
+                print(f"!! Falha ao carregar '{full_table_id}' (tentativa {tentativa}/{tentativas}): {erro}")
+
+                # O job pode ter terminado no servidor mesmo com erro aqui (ex: a conexão caiu no job.result())
+                job_concluido = buscar_job_concluido(client, job_id) if job_id is not None else None
+                if job_concluido is None:
+                    if not erro_transitorio(erro, job):
+                        break
+                    if tentativa < tentativas:
+                        time.sleep(espera_entre_tentativas * 2 ** (tentativa - 1))
+                    continue
+                print(f"O job '{job_id}' já havia terminado no servidor. A carga não será reenviada.")
+                job = job_concluido
+
+            return {
+                'linhas': job.output_rows,
+                'segundos': time.perf_counter() - inicio,
+                'tentativas': tentativa,
+                'erro': None,
+            }
+
+        return {
+            'linhas': 0,
+            'segundos': time.perf_counter() - inicio,
+            'tentativas': tentativa,
+            'erro': str(ultimo_erro),
+        }
+
+    resultados = {}
+    with ThreadPoolExecutor(max_workers=max_concorrencia) as executor:
+        futuros = {executor.submit(carregar_uma, *carga): carga[1] for carga in cargas_validas}
+        for futuro in as_completed(futuros):
+            resultados[futuros[futuro]] = futuro.result()
+
+    print("\n--- RESUMO DA CARGA ---")
+    for table_id, resultado in resultados.items():
+        situacao = 'OK' if resultado['erro'] is None else 'FALHOU'
+        print(f"{table_id:<40} {situacao:<7} {resultado['linhas']:>9} linhas "
+              f"{resultado['segundos']:>8.2f}s ({resultado['tentativas']} tentativa(s))")
+
+    return resultados
+
+
+# =============================================
+# --- METADADOS DA EXECUÇÃO NO BIGQUERY ---
+# =============================================
+
+schema_execucoes = [
+    bigquery.SchemaField("id_execucao", "STRING", mode="REQUIRED"),
+    bigquery.SchemaField("script", "STRING", mode="NULLABLE"),
+    bigquery.SchemaField("inicio", "TIMESTAMP", mode="NULLABLE"),
+    bigquery.SchemaField("fim", "TIMESTAMP", mode="NULLABLE"),
+    bigquery.SchemaField("segundos", "FLOAT", mode="NULLABLE"),
+    bigquery.SchemaField("status", "STRING", mode="NULLABLE"),
+    bigquery.SchemaField("erro", "STRING", mode="NULLABLE"),
+    bigquery.SchemaField("linhas_finais", "INTEGER", mode="NULLABLE"),
+    bigquery.SchemaField("entradas", "STRING", mode="NULLABLE"),
+    bigquery.SchemaField("etapas", "STRING", mode="NULLABLE"),
+    bigquery.SchemaField("cargas", "STRING", mode="NULLABLE")
+]
+
+schema_linhagem = [
+    bigquery.SchemaField("id_execucao", "STRING", mode="REQUIRED"),
+    bigquery.SchemaField("script", "STRING", mode="NULLABLE"),
+    bigquery.SchemaField("arquivo", "STRING", mode="NULLABLE"),
+    bigquery.SchemaField("aba", "STRING", mode="NULLABLE"),
+    bigquery.SchemaField("sha256", "STRING", mode="NULLABLE"),
+    bigquery.SchemaField("bytes", "INTEGER", mode="NULLABLE"),
+    bigquery.SchemaField("linhas_lidas", "INTEGER", mode="NULLABLE"),
+    bigquery.SchemaField("linhas_mantidas", "INTEGER", mode="NULLABLE"),
+    bigquery.SchemaField("segundos_download", "FLOAT", mode="NULLABLE"),
+    bigquery.SchemaField("segundos_leitura_arquivo", "FLOAT", mode="NULLABLE"),
+    bigquery.SchemaField("origem", "STRING", mode="NULLABLE"),
+    bigquery.SchemaField("inicio_execucao", "TIMESTAMP", mode="NULLABLE")
+]
+
+
+def salvar_metadados_bigquery(registro, project_id, client=None):
+    """
+    Acrescenta o registro da execução e a linhagem das fontes nas tabelas de
+    metadados do BigQuery. Falhas aqui só são avisadas, o log local já
+    guarda o registro.
+    """
+    df_execucao, df_linhagem = montar_tabelas_metadados(registro)
+    cargas = [
+        (df_execucao, ID_TABELA_EXECUCOES, schema_execucoes, "WRITE_APPEND"),
+        (df_linhagem, ID_TABELA_LINHAGEM, schema_linhagem, "WRITE_APPEND"),
+    ]
+    try:
+        return carregar_tabelas_bigquery(cargas, project_id, client=client, id_execucao=registro['id_execucao'])
+    except Exception as erro:
+        print(f"!! Não foi possível gravar os metadados da execução no BigQuery: {erro}")
+        return {}
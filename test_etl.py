@@ -0,0 +1,217 @@
+"""
+Testes dos scripts de ETL, sem acessar o BigQuery nem o site da SSP.
+Rode com: python -m pytest test_etl.py
+(precisa de pandas, requests e google-cloud-bigquery instalados; os
+testes do motor Polars precisam também do polars).
+"""
+import os
+import threading
+import time
+
+import pandas as pd
+import pytest
+
+pytest.importorskip('google.cloud.bigquery')
+requests = pytest.importorskip('requests')
+from google.api_core import exceptions as erros_google
+
+import etl_comum
+
+
+# =============================================
+# --- CLIENTE FALSO DO BIGQUERY ---
+# =============================================
+
+class ClienteBigQueryFalso:
+    """
+    Cliente falso para testar a carga sem acessar o BigQuery. Cada carga
+    demora 'latencia' segundos e as primeiras 'falhas_por_tabela[id]'
+    tentativas de uma tabela falham com erro transitório. As tabelas em
+    'erros_permanentes' sempre falham com erro de requisição inválida. Em
+    'perdas_de_conexao[id]' tentativas, a carga termina no servidor mas a
+    resposta se perde. Registra os envios e o pico de cargas simultâneas.
+    """
+
+    def __init__(self, latencia=0.05, falhas_por_tabela=None, erros_permanentes=(), perdas_de_conexao=None):
+        self.latencia = latencia
+        self.falhas_restantes = dict(falhas_por_tabela or {})
+        self.erros_permanentes = set(erros_permanentes)
+        self.perdas_restantes = dict(perdas_de_conexao or {})
+        self.em_andamento = 0
+        self.pico_simultaneo = 0
+        self.envios = []
+        self.cargas = []
+        self.jobs = {}
+        self._trava = threading.Lock()
+
+    def load_table_from_dataframe(self, df, table_id, job_config=None, job_id=None):
+        # Remove o projeto do id, para bater com os ids usados em 'cargas'
+        job = JobBigQueryFalso(self, df, table_id.split('.', 1)[-1])
+        with self._trava:
+            self.envios.append(job.table_id)
+            if job_id is not None:
+                self.jobs[job_id] = job
+        return job
+
+    def get_job(self, job_id):
+        with self._trava:
+            if job_id not in self.jobs:
+                raise erros_google.NotFound(f"job {job_id} não encontrado")
+            return self.jobs[job_id]
+
+
+class JobBigQueryFalso:
+    """Job devolvido pelo ClienteBigQueryFalso."""
+
+    def __init__(self, cliente, df, table_id):
+        self.cliente = cliente
+        self.df = df
+        self.table_id = table_id
+        self.output_rows = None
+        self.state = 'RUNNING'
+        self.error_result = None
+
+    def result(self):
+        if self.state == 'DONE':
+            if self.error_result is not None:
+                raise erros_google.ServiceUnavailable("falha simulada")
+            return self
+
+        cliente = self.cliente
+        with cliente._trava:
+            cliente.em_andamento += 1
+            cliente.pico_simultaneo = max(cliente.pico_simultaneo, cliente.em_andamento)
+        try:
+            time.sleep(cliente.latencia)
+            with cliente._trava:
+                self.state = 'DONE'
+                if self.table_id in cliente.erros_permanentes:
+                    self.error_result = {'reason': 'invalid'}
+                    raise erros_google.BadRequest("schema inválido (simulado)")
+                if cliente.falhas_restantes.get(self.table_id, 0) > 0:
+                    cliente.falhas_restantes[self.table_id] -= 1
+                    self.error_result = {'reason': 'backendError'}
+                    raise erros_google.ServiceUnavailable("falha simulada")
+                cliente.cargas.append(self.table_id)
+                self.output_rows = len(self.df)
+                if cliente.perdas_restantes.get(self.table_id, 0) > 0:
+                    cliente.perdas_restantes[self.table_id] -= 1
+                    raise requests.ConnectionError("conexão perdida (simulada)")
+            return self
+        finally:
+            with cliente._trava:
+                cliente.em_andamento -= 1
+
+
+def carregar(cliente, tabelas, **kwargs):
+    """Roda carregar_tabelas_bigquery com o cliente falso, sem esperas entre tentativas."""
+    df = pd.DataFrame({'valor': [1, 2]})
+    cargas = [(df, table_id, []) for table_id in tabelas]
+    return etl_comum.carregar_tabelas_bigquery(cargas, 'projeto-local', client=cliente,
+                                               espera_entre_tentativas=0, id_execucao='teste', **kwargs)
+
+
+# =============================================
+# --- CARGA PARA O BIGQUERY ---
+# =============================================
+
+def test_carga_respeita_max_concorrencia():
+    cliente = ClienteBigQueryFalso()
+    tabelas = [f'dados_ssp.tabela_{i}' for i in range(6)]
+    resultados = carregar(cliente, tabelas, max_concorrencia=2)
+
+    assert cliente.pico_simultaneo == 2
+    assert sorted(cliente.cargas) == tabelas
+    assert all(resultado['erro'] is None for resultado in resultados.values())
+
+
+def test_carga_repete_apenas_erros_transitorios():
+    cliente = ClienteBigQueryFalso(falhas_por_tabela={'dados_ssp.instavel': 2},
+                                   erros_permanentes={'dados_ssp.schema_errado'})
+    resultados = carregar(cliente, ['dados_ssp.instavel', 'dados_ssp.schema_errado'], tentativas=3)
+
+    assert resultados['dados_ssp.instavel']['erro'] is None
+    assert resultados['dados_ssp.instavel']['tentativas'] == 3
+    assert resultados['dados_ssp.schema_errado']['erro'] is not None
+    assert resultados['dados_ssp.schema_errado']['tentativas'] == 1
+    assert cliente.envios.count('dados_ssp.schema_errado') == 1
+
+
+def test_carga_nao_reenvia_apos_perder_a_resposta():
+    cliente = ClienteBigQueryFalso(perdas_de_conexao={'dados_ssp.execucoes_pipeline': 1})
+    resultados = carregar(cliente, ['dados_ssp.execucoes_pipeline'])
+
+    assert cliente.envios == ['dados_ssp.execucoes_pipeline']
+    assert cliente.cargas == ['dados_ssp.execucoes_pipeline']
+    assert resultados['dados_ssp.execucoes_pipeline']['erro'] is None
+    assert resultados['dados_ssp.execucoes_pipeline']['linhas'] == 2
+
+
+# =============================================
+# --- MOTORES DE TRANSFORMAÇÃO (PANDAS x POLARS) ---
+# =============================================
+
+PASTA_PROJETO = os.path.dirname(os.path.abspath(__file__))
+
+
+def carregar_script(nome_arquivo):
+    """
+    Executa a 'Célula 2' do script (sem a autenticação do Colab e sem o
+    roteiro principal) e devolve as funções e parâmetros definidos nela.
+    """
+    caminho = os.path.join(PASTA_PROJETO, nome_arquivo)
+    with open(caminho, encoding='utf-8') as f:
+        fonte = f.read()
+    celula = fonte[fonte.index('# Célula 2'):fonte.index('# --- ROTEIRO PRINCIPAL')]
+    script = {'__name__': nome_arquivo}
+    exec(compile(celula, caminho, 'exec'), script)
+    return script
+
+
+@pytest.fixture
+def ddm(tmp_path, monkeypatch):
+    """Script_ddm.py carregado, rodando numa pasta vazia (sem correções de bairros locais)."""
+    pytest.importorskip('polars')
+    script = carregar_script('Script_ddm.py')
+    monkeypatch.chdir(tmp_path)
+    return script
+
+
+@pytest.fixture
+def ddm_bruto(ddm):
+    """
+    O dados_ddm.csv revertido para o formato bruto da SSP: nomes originais
+    das colunas e data em dd/mm/aaaa.
+    """
+    df_amostra = pd.read_csv(os.path.join(PASTA_PROJETO, 'dados_ddm.csv'))
+    mapa_inverso = {v: k for k, v in ddm['mapa_renomear'].items()}
+    df_bruto = df_amostra.drop(columns=['mes_ocorrencia', 'dia_semana']).rename(columns=mapa_inverso)
+    df_bruto['DATA_OCORRENCIA_BO'] = pd.to_datetime(df_bruto['DATA_OCORRENCIA_BO']).dt.strftime('%d/%m/%Y')
+    return df_bruto
+
+
+def test_motores_geram_o_mesmo_resultado(ddm, ddm_bruto):
+    ddm_bruto.to_csv('amostra_bruta_ddm.csv', index=False)
+
+    resultado_pandas = ddm['transformar_dados'](ddm['filtrar_regioes'](pd.read_csv('amostra_bruta_ddm.csv')))
+    resultado_polars = ddm['transformar_dados_polars']('amostra_bruta_ddm.csv')
+
+    assert len(resultado_pandas) > 0
+    pd.testing.assert_frame_equal(
+        resultado_pandas.reset_index(drop=True),
+        resultado_polars.reset_index(drop=True),
+        check_dtype=False,
+    )
+
+
+def test_motores_com_tipos_misturados(ddm, ddm_bruto):
+    # Como chega das planilhas: NUM_BO com texto e números na mesma coluna
+    df_misto = ddm_bruto.copy()
+    df_misto['NUM_BO'] = df_misto['NUM_BO'].astype(object)
+    df_misto.loc[df_misto.index[::2], 'NUM_BO'] = 12345
+
+    pd.testing.assert_frame_equal(
+        ddm['transformar_dados'](ddm['filtrar_regioes'](df_misto)).reset_index(drop=True),
+        ddm['transformar_dados_polars'](df_misto).reset_index(drop=True),
+        check_dtype=False,
+    )